@@ -0,0 +1,179 @@
+"""
+Offline benchmark for the record pool classes.
+
+Runs each pool against a local stand-in of its site and reports pages/min, tracks/min and MB/s.
+Needs Chrome but no network access or pool accounts.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+from pathlib import Path
+
+from fixtures import FixtureServer, FixtureSettings
+
+# The pool modules live in the src directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from Bandcamp import Bandcamp  # noqa: E402
+from Beatjunkies import Beatjunkies  # noqa: E402
+from BPMSupreme import BPMSupreme  # noqa: E402
+from colorprint import Color, print_bold, print_color, print_red  # noqa: E402
+from DJCity import DJCity  # noqa: E402
+from RecordPool import RecordPool  # noqa: E402
+
+POOLS = ("beatjunkies", "bpmsupreme", "djcity", "bandcamp")
+
+
+@contextlib.contextmanager
+def isolated_environment(workdir: str):
+    """Point the state directory, download root and Chrome profile defaults inside the work directory."""
+    values = {
+        "RECORDPOOL_CHROME_PROFILE": os.path.join(workdir, "profile"),
+        "RECORDPOOL_DOWNLOAD_ROOT": os.path.join(workdir, "downloads"),
+        "RECORDPOOL_STATE_DIR": os.path.join(workdir, "state"),
+    }
+    saved = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def create_pool(name: str, base_url: str, workdir: str, workers: int) -> RecordPool:
+    """Create a headless pool that uses the fixture site and keeps all files inside the work directory."""
+    # never touch the real downloads, browser profile, saved session or download history,
+    # not even while constructing the pool, which opens the ledger, journal and download directory.
+    # The ChromeDriver cache is only used later, so it stays in the real state directory and works offline.
+    with isolated_environment(workdir):
+        if name == "beatjunkies":
+            pool = Beatjunkies()
+        elif name == "bpmsupreme":
+            pool = BPMSupreme()
+        elif name == "djcity":
+            pool = DJCity()
+        else:
+            pool = Bandcamp(f"{base_url}/bandcamp/download")
+
+        pool.configure(
+            {
+                "base_url": base_url,
+                "batch": True,
+                "headless": True,
+                "session": False,
+                "staging_dir": os.path.join(workdir, "staging"),
+                "workers": workers,
+            }
+        )
+
+    pool.report_stats = False
+    return pool
+
+
+def run_pool(name: str, base_url: str, pages: int, workers: int) -> dict:
+    """Download the given number of fixture pages with the pool and return the results."""
+    result = {"pool": name, "pages": 0, "tracks": 0, "seconds": 0.0, "bytes": 0}
+    with tempfile.TemporaryDirectory(prefix=f"recordpool-benchmark-{name}-") as workdir:
+        pool = create_pool(name, base_url, workdir, workers)
+        try:
+            pool.start_driver(prepare=False)
+            start = time.perf_counter()
+            while True:
+                pool.download_page()
+                result["pages"] += 1
+                if result["pages"] >= pages or not pool.next_page():
+                    break
+
+            result["seconds"] = time.perf_counter() - start
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            print_red(f"{name} failed: {result['error']}")
+            traceback.print_exc()
+        finally:
+            result["tracks"] = pool.total_files_downloaded
+            result["bytes"] = pool.stats.total_bytes
+            result["phases"] = pool.stats.summary()["phases"]
+            pool.quit()
+
+    minutes = result["seconds"] / 60
+    result["pages_per_min"] = result["pages"] / minutes if minutes else 0.0
+    result["tracks_per_min"] = result["tracks"] / minutes if minutes else 0.0
+    result["mb_per_s"] = result["bytes"] / (1024 * 1024) / result["seconds"] if result["seconds"] else 0.0
+    return result
+
+
+def print_results(results: list[dict]):
+    print_bold(
+        f"\n{'pool':<12} {'pages':>6} {'tracks':>7} {'time':>8} {'pages/min':>10} {'tracks/min':>11} {'MB/s':>8}"
+    )
+    for result in results:
+        line = (
+            f"{result['pool']:<12} {result['pages']:>6} {result['tracks']:>7} {result['seconds']:>7.1f}s "
+            f"{result['pages_per_min']:>10.1f} {result['tracks_per_min']:>11.1f} {result['mb_per_s']:>8.2f}"
+        )
+        print_color(line, Color.red if "error" in result else Color.green)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the record pools against local fixture sites.")
+    parser.add_argument("pools", nargs="*", help=f"pools to benchmark, default is all: {', '.join(POOLS)}")
+    parser.add_argument("-p", "--pages", type=int, default=3, help="pages to download from each pool")
+    parser.add_argument("-t", "--tracks", type=int, default=10, help="tracks on each page")
+    parser.add_argument("-s", "--file-size", type=float, default=2.0, help="size of each file in MB")
+    parser.add_argument("-l", "--latency", type=float, default=50, help="delay before each response in ms")
+    parser.add_argument("-b", "--bandwidth", type=float, default=0, help="total bandwidth in MB/s, 0 is unlimited")
+    parser.add_argument(
+        "--stream-bandwidth", type=float, default=0, help="bandwidth of one transfer in MB/s, 0 is unlimited"
+    )
+    parser.add_argument("--prepare-delay", type=float, default=1.0, help="Bandcamp download preparing time in s")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="parallel file downloads")
+    parser.add_argument("-o", "--output", default="", help="also write the results to this JSON file")
+    args = parser.parse_args()
+    args.pools = [name.lower() for name in args.pools] if args.pools else list(POOLS)
+    if unknown := [name for name in args.pools if name not in POOLS]:
+        parser.error(f"unknown pools: {', '.join(unknown)}")
+
+    return args
+
+
+def main():
+    args = parse_args()
+    megabyte = 1024 * 1024
+    settings = FixtureSettings(
+        pages=args.pages,
+        tracks_per_page=args.tracks,
+        file_size=int(args.file_size * megabyte),
+        latency=args.latency / 1000,
+        bandwidth=int(args.bandwidth * megabyte),
+        stream_bandwidth=int(args.stream_bandwidth * megabyte),
+        prepare_delay=args.prepare_delay,
+    )
+    server = FixtureServer(settings).start()
+    print(f"Fixture server running at {server.base_url}")
+    try:
+        results = [run_pool(name, server.base_url, args.pages, args.workers) for name in args.pools]
+    finally:
+        server.stop()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"settings": vars(args), "results": results}, file, indent=2)
+
+    if any("error" in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
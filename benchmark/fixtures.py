@@ -0,0 +1,250 @@
+"""
+Local stand-in versions of the record pool sites for offline benchmarking.
+
+Serves pages with the same DOM structure the pool classes depend on,
+and synthetic audio files with configurable latency and bandwidth.
+"""
+
+import hashlib
+import html
+import re
+import threading
+import time
+
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class FixtureSettings:
+    """Size and speed of the fixture sites."""
+
+    pages: int = 3
+    tracks_per_page: int = 10
+    # Size of each audio file in bytes
+    file_size: int = 2 * 1024 * 1024
+    # Delay before each response in seconds
+    latency: float = 0.05
+    # Total bandwidth shared by all transfers, and the bandwidth of a single transfer, in bytes per second.
+    # Zero means unlimited.
+    bandwidth: int = 0
+    stream_bandwidth: int = 0
+    # How long Bandcamp takes to prepare each download in seconds
+    prepare_delay: float = 1.0
+
+
+class Throttle:
+    """Limit the data rate of transfers sharing this throttle."""
+
+    def __init__(self, rate: int):
+        self.rate: int = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def take(self, size: int):
+        """Block until sending the given number of bytes fits in the rate limit."""
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(now, self._next) + size / self.rate
+            delay = self._next - now
+
+        time.sleep(delay)
+
+
+def page(title: str, body: str) -> str:
+    return f"<!DOCTYPE html><html><head><title>{html.escape(title)}</title></head><body>{body}</body></html>"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serve the fixture pages and audio files."""
+
+    server: "FixtureServer"
+    protocol_version = "HTTP/1.1"
+    chunk_size = 64 * 1024
+
+    def do_GET(self):  # noqa: N802
+        settings = self.server.settings
+        time.sleep(settings.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        routes = (
+            (r"/record-pool/page/(\d+)/", self.beatjunkies_page),
+            (r"/uk/digital/records.aspx", self.djcity_page),
+            (r"/uk/digital/review/(\d+)-(\d+)", self.djcity_review),
+            (r"/new-releases/classic/audio", self.bpmsupreme_page),
+            (r"/bandcamp/download", self.bandcamp_page),
+            (r"/files/(\w+)/([\w-]+\.\w+)", self.audio_file),
+        )
+        for pattern, handler in routes:
+            if match := re.fullmatch(pattern, url.path):
+                handler(*match.groups(), query=query)
+                return
+
+        self.send_error(404)
+
+    def beatjunkies_page(self, number: str, query: dict):
+        number = int(number)
+        rows = "".join(
+            f'<div class="track">{self.title("beatjunkies", number, index)}'
+            f'<a class="glyphicon glyphicon-arrow-down icon-right inline-exclude" '
+            f'href="/files/beatjunkies/p{number}-t{index}.mp3"></a></div>'
+            for index in self.indexes()
+        )
+        body = f'<div class="widget widget-beats playlist">{rows}</div>'
+        if number < self.server.settings.pages:
+            body += f'<a class="nextpostslink" href="/record-pool/page/{number + 1}/">»</a>'
+
+        self.send_html(page("Beatjunkies", body))
+
+    def djcity_page(self, query: dict):
+        number = int(query.get("p", ["1"])[0])
+        rows = "".join(
+            f'<div class="track">{self.title("djcity", number, index)}'
+            f'<a class="downloadBtn" href="/uk/digital/review/{number}-{index}">Download</a></div>'
+            for index in self.indexes()
+        )
+        self.send_html(page("DJCity", f'<div class="float_left page_left">{rows}</div>'))
+
+    def djcity_review(self, number: str, index: str, query: dict):
+        stars = "".join(f'<span data-value="{value}">*</span>' for value in range(1, 6))
+        links = "".join(
+            f'<div class="float_right reviw_tdonw"><a href="/files/djcity/p{number}-t{index}-{version}.mp3">'
+            f"{version}</a></div>"
+            for version in ("clean", "dirty")
+        )
+        self.send_html(page("DJCity review", f'<div class="rating-stars">{stars}</div>{links}'))
+
+    def bpmsupreme_page(self, query: dict):
+        number = int(query.get("page", ["1"])[0])
+        rows = "".join(
+            f'<div class="row-container"><div>{self.title("bpmsupreme", number, index)}</div>'
+            f"<div class='col-category link'>Hip Hop</div><div class=\"row-tags\">"
+            + "".join(
+                f"<span class='tag-view ' onclick=\"location.href='/files/bpmsupreme/p{number}-t{index}-{version}.mp3'\">"
+                f"{version.title()}</span>"
+                for version in ("clean", "dirty")
+            )
+            + "</div></div>"
+            for index in self.indexes()
+        )
+        pagination = f'<span class="selected">{number}</span>'
+        if number < self.server.settings.pages:
+            pagination += f'<a href="/new-releases/classic/audio?page={number + 1}">›</a>'
+
+        body = f'<div class="table-media">{rows}</div><div class="pagination">{pagination}</div>'
+        self.send_html(page("BPM Supreme", body))
+
+    def bandcamp_page(self, query: dict):
+        items = "".join(
+            f'<div class="download-title"><div>{self.title("bandcamp", 1, index)}</div>'
+            f'<a class="item-button" style="display: none" href="/files/bandcamp/t{index}.zip">Download</a></div>'
+            for index in self.indexes()
+        )
+        # the download buttons appear one by one, like when Bandcamp has prepared the files
+        delay = int(self.server.settings.prepare_delay * 1000)
+        script = f"""
+        document.querySelectorAll(".item-button").forEach((button, index) => {{
+            setTimeout(() => button.style.display = "inline", {delay} * (index + 1));
+        }});
+        """
+        self.send_html(page("Bandcamp", f'<div class="downloads">{items}</div><script>{script}</script>'))
+
+    def audio_file(self, pool: str, name: str, query: dict):
+        settings = self.server.settings
+        size = settings.file_size
+        etag = '"' + hashlib.sha1(f"{pool}/{name}".encode()).hexdigest()[:16] + '"'
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match and self.headers.get("If-Range", etag) == etag:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+
+        content_type = "application/zip" if name.endswith(".zip") else "audio/mpeg"
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("Content-Disposition", f'attachment; filename="{self.filename(pool, name)}"')
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+
+        stream = Throttle(settings.stream_bandwidth)
+        sent = start
+        while sent < size:
+            chunk = self.server.data[: min(self.chunk_size, size - sent)]
+            self.server.throttle.take(len(chunk))
+            stream.take(len(chunk))
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+            sent += len(chunk)
+
+    def filename(self, pool: str, name: str) -> str:
+        # BPMSupreme names the files after the track, which is how the clicked downloads are recognized
+        if pool == "bpmsupreme" and (match := re.fullmatch(r"p(\d+)-t(\d+)-(\w+)\.mp3", name)):
+            number, index, version = match.groups()
+            return f"{self.title(pool, int(number), int(index))} ({version.title()}).mp3"
+
+        return f"{pool}-{name}"
+
+    def indexes(self) -> range:
+        return range(1, self.server.settings.tracks_per_page + 1)
+
+    @staticmethod
+    def title(pool: str, number: int, index: int) -> str:
+        return f"Fixture Artist {index} - {pool.title()} Track {number}.{index}"
+
+    def send_html(self, text: str):
+        data = text.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # keep the benchmark output clean
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """HTTP server for the fixture sites, running in a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self, settings: FixtureSettings, port: int = 0):
+        super().__init__(("127.0.0.1", port), FixtureHandler)
+        self.settings: FixtureSettings = settings
+        self.throttle = Throttle(settings.bandwidth)
+        # one chunk of filler starting with an MP3 frame header, repeated for the whole file
+        block = b"\xff\xfb\x90\x64" + hashlib.sha256(b"recordpool").digest() * 2048
+        self.data: bytes = (block * (FixtureHandler.chunk_size // len(block) + 1))[: FixtureHandler.chunk_size]
+        self._thread = threading.Thread(target=self.serve_forever, name="fixture-server", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FixtureServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
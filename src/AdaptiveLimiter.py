@@ -0,0 +1,125 @@
+import logging
+import random
+import threading
+import time
+
+from urllib.parse import urlparse
+
+
+class HostLimit:
+    """
+    Concurrency limit for one host, adjusted with additive increase and multiplicative decrease.
+
+    The throughput is measured over windows of as many finished transfers as the current limit.
+    The limit grows by one after a window where the throughput grew and few transfers failed,
+    and is halved when the server signals overload, at most once per cooldown period.
+    """
+
+    def __init__(self, host: str, initial: int = 2, maximum: int = 4, cooldown: float = 5.0):
+        self.cooldown: float = cooldown
+        self.host: str = host
+        self.in_flight: int = 0
+        self.limit: int = max(1, min(initial, maximum))
+        self.max_error_rate: float = 0.1
+        self.maximum: int = max(1, maximum)
+        # minimum relative throughput increase that counts as growth
+        self.min_growth: float = 0.05
+        self._condition = threading.Condition()
+        self._last_cut: float = 0.0
+        self._last_rate: float = 0.0
+        self._reset_window()
+
+    def acquire(self):
+        """Wait until a transfer to the host can start."""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+
+            self.in_flight += 1
+
+    def release(self, size: int = 0, failed: bool = False, throttled: bool = False):
+        """Finish a transfer and adjust the limit based on the result."""
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_cut > self.cooldown and self.limit > 1:
+                    self.limit = max(1, self.limit // 2)
+                    logging.warning(f"{self.host}: server is throttling, lowered concurrency to {self.limit}")
+
+                self._last_cut = now
+                self._last_rate = 0.0
+                self._reset_window()
+            else:
+                self._window_bytes += size
+                if failed:
+                    self._window_errors += 1
+                else:
+                    self._window_files += 1
+
+                if self._window_files + self._window_errors >= self.limit:
+                    self._end_window(now)
+
+            self._condition.notify_all()
+
+    def _end_window(self, now: float):
+        elapsed = now - self._window_start
+        rate = self._window_bytes / elapsed if elapsed > 0 else 0.0
+        error_rate = self._window_errors / (self._window_files + self._window_errors)
+        if (
+            error_rate <= self.max_error_rate
+            and rate > self._last_rate * (1 + self.min_growth)
+            and self.limit < self.maximum
+        ):
+            self.limit += 1
+            logging.info(f"{self.host}: throughput {rate / (1024 * 1024):.2f} MB/s, raised concurrency to {self.limit}")
+
+        self._last_rate = rate
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_bytes: int = 0
+        self._window_errors: int = 0
+        self._window_files: int = 0
+        self._window_start: float = time.monotonic()
+
+
+class AdaptiveLimiter:
+    """
+    Per-host concurrency limits with a shared retry budget and jittered exponential backoff.
+
+    Finds the highest transfer rate each host sustains without errors,
+    and stops retrying once the budget for the run has been used, so a failing pool is not hammered.
+    """
+
+    def __init__(self, workers: int = 4, retry_budget: int = 30, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.retries: int = 0
+        self.retry_budget: int = retry_budget
+        self.workers: int = workers
+        self._hosts: dict[str, HostLimit] = {}
+        self._lock = threading.Lock()
+
+    def host(self, url: str) -> HostLimit:
+        """Return the limit for the host of the url."""
+        name = urlparse(url).netloc
+        with self._lock:
+            if name not in self._hosts:
+                self._hosts[name] = HostLimit(name, maximum=self.workers)
+
+            return self._hosts[name]
+
+    def use_retry(self) -> bool:
+        """Take one retry from the budget, or return false if it has been used up."""
+        with self._lock:
+            if self.retries >= self.retry_budget:
+                return False
+
+            self.retries += 1
+            return True
+
+    def backoff(self, attempt: int, retry_after: float = 0.0) -> float:
+        """Return the delay before the given retry attempt, or the delay requested by the server if it is longer."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        return max(delay, min(retry_after, self.max_delay))
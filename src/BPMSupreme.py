@@ -1,128 +1,298 @@
-import time
+import logging
+import re
+
+from collections.abc import Iterator
 
 from selenium.common.exceptions import (
     ElementClickInterceptedException,
     ElementNotInteractableException,
     StaleElementReferenceException,
-    TimeoutException,
 )
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.support.ui import WebDriverWait
+from tqdm import tqdm
 
+from colorprint import print_magenta
+from DownloadCapture import CapturedDownload
+from PageWaiter import Condition, dom_settled, selector_absent, selector_present
 from RecordPool import RecordPool
-from utils import Site
+from utils import Site, Track
+
+# True when the selected page number in the pagination differs from the given number
+PAGE_CHANGED_SCRIPT = """
+const selected = document.querySelector(".pagination .selected");
+return selected !== null && selected.innerText.trim() !== arguments[0];
+"""
+
+# Extracts title, artist, genre, BPM, key and version tags for every row in the track table with a single script call.
+# The row does not expose a track id, so the first line of the row text is used as the title.
+ROWS_SCRIPT = """
+const table = document.querySelector(".table-media");
+if (!table) {
+    return [];
+}
+const text = (row, selector) => {
+    const element = row.querySelector(selector);
+    return element ? element.innerText.trim() : "";
+};
+return Array.from(table.querySelectorAll(".row-container"), row => ({
+    title: row.innerText.split("\\n")[0].trim(),
+    artist: text(row, "[class*='col-artist']"),
+    genre: text(row, "[class='col-category link']"),
+    bpm: parseFloat(text(row, "[class*='col-bpm']")) || null,
+    key: text(row, "[class*='col-key']"),
+    tags: Array.from(row.querySelectorAll(".row-tags [class='tag-view ']"), tag => ({
+        version: tag.innerText.trim(),
+        element: tag,
+    })),
+}));
+"""
 
 
 class BPMSupreme(RecordPool):
     def __init__(self):
         super().__init__(Site.BPMSUPREME)
-        self.url = "https://app.bpmsupreme.com/new-releases/classic/audio"
+        self.base_url = "https://app.bpmsupreme.com"
+        self.url = f"{self.base_url}/new-releases/classic/audio"
+        # The track list is rendered by scripts after the page has loaded
+        self.ready_conditions = [selector_present(".table-media .row-container"), dom_settled()]
         self.wait_time = 10
-        self.track_ignore = (
-            "Short Edit",
-            "Clean Short Edit",
-            "Dirty Short Edit",
-            "Quick Hit Clean",
-            "Quick Hit",
-            "Quick Hit Dirty",
-        )
-
-        self.genre_ignore = (
-            "Alternative",
-            "Bachata",
-            "Banda",
-            "Country",
-            "Corrido",
-            "Cumbia",
-            "Cumbias",
-            "Dancehall",
-            "Dembow",
-            "Drum Loops",
-            "Latin Pop",
-            "Mambo",
-            "Mariachi",
-            "Norteno",
-            "Reggae",
-            "Reggaeton",
-            "Rock",
-            "Salsa",
-            "Scratch Tools",
-            "Soca",
-        )
+        # The file urls are created by the site scripts when clicking, so read them from the browser events
+        self.capture_downloads = True
+        # Only use the browser to get the file urls, and download them in parallel over HTTP
+        self.direct_capture = False
+        # files are downloaded by the browser, so audio must not be blocked
+        self.allow_urls = ["media"]
+        self.default_rules = [
+            {
+                "action": "skip",
+                "genre": [
+                    "Alternative",
+                    "Bachata",
+                    "Banda",
+                    "Country",
+                    "Corrido",
+                    "Cumbia",
+                    "Cumbias",
+                    "Dancehall",
+                    "Dembow",
+                    "Drum Loops",
+                    "Latin Pop",
+                    "Mambo",
+                    "Mariachi",
+                    "Norteno",
+                    "Reggae",
+                    "Reggaeton",
+                    "Rock",
+                    "Salsa",
+                    "Scratch Tools",
+                    "Soca",
+                ],
+            },
+            {
+                "action": "skip",
+                "version": [
+                    "Short Edit",
+                    "Clean Short Edit",
+                    "Dirty Short Edit",
+                    "Quick Hit Clean",
+                    "Quick Hit",
+                    "Quick Hit Dirty",
+                ],
+            },
+        ]
+        self.set_rules([])
 
     def click(self, element):
         self.driver.execute_script("arguments[0].click()", element)
 
+    def configure(self, settings: dict):
+        # the old ignore lists replace the matching default rule
+        for rule, name in zip(self.default_rules, ("genre", "version")):
+            rule[name] = list(settings.get(f"ignore_{name}s", rule[name]))
+
+        super().configure(settings)
+        self.direct_capture = settings.get("direct_capture", self.direct_capture)
+
     def close_error_popup(self):
-        elements = self.driver.find_elements_by_xpath(".//*[@class='sweet-alert showSweetAlert visible']")
+        elements = self.driver.find_elements(By.XPATH, ".//*[@class='sweet-alert showSweetAlert visible']")
         if elements:
-            button = elements[0].find_element_by_class_name("confirm")
+            button = elements[0].find_element(By.CLASS_NAME, "confirm")
             self.click(button)
-            time.sleep(0.5)
+            # the popup fades out before the page can be clicked again
+            self.waiter.wait(selector_absent(".sweet-alert.showSweetAlert.visible"))
 
-    def download(self, track):
+    def download(self, track: Track):
         try:
-            self.click(track)
-            # give download a bit of time to start before returning
-            time.sleep(0.6)
+            captured = self.click_and_capture(track)
         except StaleElementReferenceException:
             return
 
-    def get_page_number(self) -> int:
-        WebDriverWait(self.driver, self.wait_time).until(
-            expected_conditions.visibility_of_element_located((By.CLASS_NAME, "pagination"))
+        self.tracker.expect_download()
+        if captured:
+            track.url = captured.url
+            self.captured[track.id] = captured
+        elif not self.tracker.wait_for_start(self.wait_time):
+            logging.warning("Download did not start after clicking")
+
+    def fetch(self, tracks: list[Track]) -> int:
+        if tracks and self.manifest:
+            # the manifest needs the file urls, which are only created by clicking
+            return self.write_manifest(list(self.resolve_download_urls(tracks)))
+
+        if not self.direct_capture or not tracks:
+            return super().fetch(tracks)
+
+        print_magenta("Downloading files...")
+        self.ledger.mark_queued(self.name, tracks)
+        self.journal.queued(tracks)
+        if not self.http:
+            self.http = self.create_http_downloader()
+
+        self.http.copy_browser_session(self.driver)
+        downloads = {}
+        for track in self.resolve_download_urls(tracks):
+            # store the url so a failed download can be retried without clicking
+            self.ledger.mark_queued(self.name, [track])
+            downloads[self.http.submit(track)] = track
+
+        print_magenta("Waiting for downloads to finish...")
+        with self.stats.timer("completion_wait"):
+            results = self.http.wait(downloads)
+
+        for track in tracks:
+            self.captured.pop(track.id, None)
+
+        num_tracks = self.record_downloads(tracks, results)
+        self.total_files_downloaded += num_tracks
+        return num_tracks
+
+    def resolve_download_urls(self, tracks: list[Track]) -> Iterator[Track]:
+        """Click each track without letting the browser download it, and yield the tracks with a new file url."""
+        urls = set()
+        # clicking still creates the file url, but the browser does not download the file
+        self.set_download_behavior(allow=False)
+        try:
+            for track in tqdm(tracks):
+                with self.stats.timer("dispatch"):
+                    url = self.resolve_download_url(track)
+
+                if not url:
+                    continue
+
+                if url in urls:
+                    logging.info(f"Skipping duplicate download url: {track.id}")
+                    continue
+
+                urls.add(url)
+                yield track
+        finally:
+            self.set_download_behavior()
+
+    def resolve_download_url(self, track: Track) -> str:
+        """Click the download button and return the file url the site created, or an empty string if none."""
+        try:
+            captured = self.click_and_capture(track)
+        except StaleElementReferenceException:
+            return ""
+
+        if not captured:
+            logging.warning(f"No download url captured after clicking: {track.id}")
+            return ""
+
+        track.url = captured.url
+        self.captured[track.id] = captured
+        return track.url
+
+    def click_and_capture(self, track: Track) -> CapturedDownload | None:
+        """Click the download button and return the download it started, or None if it was not captured."""
+        if not self.capture:
+            self.click(track.element)
+            return None
+
+        # events from earlier clicks must not be taken as the download of this track
+        self.capture.begin()
+        self.click(track.element)
+        # return as soon as the download has started instead of sleeping a fixed time
+        return self.capture.wait_for_download(
+            self.wait_time, match=lambda download: self.is_track_file(track, download)
         )
-        container = self.driver.find_element_by_class_name("pagination")
-        page = container.find_element_by_class_name("selected")
+
+    @staticmethod
+    def is_track_file(track: Track, download: CapturedDownload) -> bool:
+        """Return true if the download is a file of the track, or if the file name is not known."""
+
+        def normalize(text: str) -> str:
+            return re.sub(r"[^a-z0-9]", "", text.lower())
+
+        name = normalize(download.filename)
+        return not name or all(normalize(part) in name for part in (track.title, track.version))
+
+    def get_page_number(self) -> int:
+        if not self.waiter.wait(selector_present(".pagination .selected")):
+            return self.current_page_number
+
+        page = self.driver.find_element(By.CSS_SELECTOR, ".pagination .selected")
         number = int(page.text)
         return number
 
-    def get_tracks(self, number=0) -> list:
+    def get_tracks(self, number=0) -> list[Track]:
         tracks = []
-        try:
-            # wait for songs to load
-            WebDriverWait(self.driver, self.wait_time).until(
-                expected_conditions.visibility_of_element_located((By.CLASS_NAME, "table-media"))
-            )
-        except TimeoutException:
-            print(f"No tracks found after waiting for {self.wait_time} seconds...")
-            return tracks
-
-        playlist = self.driver.find_element_by_class_name("table-media")
-        songs = playlist.find_elements(by=By.CLASS_NAME, value="row-container")
-        num_max = min(number, len(songs)) if number > 0 else len(songs)
-        for song in songs[:num_max]:
-            genre = song.find_element_by_xpath(".//*[@class='col-category link']")
-            if genre.text in self.genre_ignore:
-                continue
-
-            tag = song.find_element_by_class_name("row-tags")
-            elements = tag.find_elements_by_xpath(".//*[@class='tag-view ']")
-            filtered = [e for e in elements if e.text not in self.track_ignore]
-            if filtered:
-                tracks.extend(filtered)
+        # wait for songs to load
+        self.waiter.require(selector_present(".table-media"))
+
+        rows = self.driver.execute_script(ROWS_SCRIPT)
+        rows = rows[: self.check_watermark([row["title"] for row in rows])]
+        num_max = min(number, len(rows)) if number > 0 else len(rows)
+        for row in rows[:num_max]:
+            for tag in row["tags"]:
+                tracks.append(
+                    Track(
+                        id=f"{row['title']} - {tag['version']}",
+                        title=row["title"],
+                        version=tag["version"],
+                        genre=row["genre"],
+                        artist=row["artist"],
+                        bpm=row["bpm"],
+                        key=row["key"],
+                        element=tag["element"],
+                    )
+                )
+
+        # one pass over the whole page, so only the preferred version of each title is kept
+        tracks = self.rules.select(tracks)
 
         return tracks
 
+    def is_logged_in(self) -> bool:
+        # the app redirects to the login page when the session has expired
+        return "/login" not in self.driver.current_url
+
     def next_page(self) -> bool:
         self.close_error_popup()
         if self.driver.current_url != self.current_url:
             self.reload_page()
 
-        container = self.driver.find_element_by_class_name("pagination")
+        elements = self.driver.find_elements(By.XPATH, "//*[contains(text(), '›')]")
+        if not elements:
+            return False
+
+        previous = self.get_page_number()
         try:
-            element = container.find_element_by_xpath("//*[contains(text(), '›')]")
-            self.click(element)
+            self.click(elements[0])
         except (
             ElementNotInteractableException,
             ElementClickInterceptedException,
-            TimeoutException,
         ):
             return False
 
+        # the page changes without a page load, so wait for the new page number
+        self.waiter.require(Condition("page change", PAGE_CHANGED_SCRIPT, (str(previous),)))
         self.update_current_page()
         return True
 
     def prepare_pool(self):
+        if self.batch:
+            # the genres selected on the site are stored in the browser profile
+            return
+
         input("Choose genres manually and press a key to continue...")
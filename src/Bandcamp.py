@@ -2,31 +2,36 @@ import logging
 import sys
 import time
 
+from collections.abc import Iterator
+
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.support.ui import WebDriverWait
 from tqdm import tqdm
 
-from colorprint import print_error, print_magenta
+from colorprint import print_error, print_magenta, print_red
+from PageWaiter import selector_present
 from RecordPool import RecordPool
-from utils import Site
+from TrackRules import parse_title
+from utils import Site, Track
+
+# Returns the download url for each item that Bandcamp has finished preparing, or null if it is not ready yet.
+# The download button is hidden until the file has been prepared.
+READY_LINKS_SCRIPT = """
+return arguments[0].map(item => {
+    const button = item.querySelector(".item-button");
+    return button && button.href && button.offsetParent !== null ? button.href : null;
+});
+"""
 
 
 class Bandcamp(RecordPool):
     def __init__(self, url):
         super().__init__(Site.BANDCAMP)
+        self.direct_download = True
+        self.poll_interval = 1.0
+        self.prepare_timeout = 600
+        self.base_url = "https://bandcamp.com"
         self.url = url
-
-    def download(self, track):
-        for _ in range(3):
-            try:
-                self.driver.get(track)
-                time.sleep(2)
-                break
-            except Exception as e:
-                print(e)
-
-            time.sleep(10)
+        self.ready_conditions = [selector_present(".download-title")]
 
     def download_page(self, num_to_download=0) -> int:
         # overridden to directly download files without using 'get_tracks'
@@ -40,31 +45,49 @@ class Bandcamp(RecordPool):
             print_error("No downloads found. Something is probably broken...")
             sys.exit(1)
 
-        tracks = downloads[0].find_elements(by=By.CLASS_NAME, value="download-title")
-        if not tracks:
+        items = downloads[0].find_elements(by=By.CLASS_NAME, value="download-title")
+        if not items:
             print_error("No items to download. Something is probably broken...")
             sys.exit(1)
 
-        logging.info(f"Found {len(tracks)} items to download")
+        logging.info(f"Found {len(items)} items to download")
+        # the download links are signed and change between visits, so use the item title as the id
+        titles = self.driver.execute_script("return arguments[0].map(item => item.innerText.trim())", items)
+        tracks = []
+        for text, item in zip(titles, items):
+            name = text.split("\n")[0]
+            artist, title, version = parse_title(name)
+            tracks.append(Track(id=name, artist=artist, title=title, version=version, element=item))
+
+        tracks = self.rules.select(tracks)
+        tracks = self.ledger.filter_new(self.name, tracks)
+        if not tracks:
+            print_red("All items have already been downloaded!\n")
+            return 0
+
+        if self.manifest:
+            # the download links are only created once Bandcamp has prepared the files
+            return self.write_manifest(list(self.resolve_download_links(tracks)))
 
         print_magenta(f"Downloading {len(tracks)} items...")
-        # TODO: get download links using async tasks instead of sequentially to speedup download
-        for song in tqdm(tracks, unit="item"):
-            # wait for Bandcamp to prepare download
-            button = WebDriverWait(song, 600).until(
-                expected_conditions.element_to_be_clickable((By.CLASS_NAME, "item-button"))
-            )
-            url = button.get_attribute("href")
-            logging.debug(f"url: {url}")
-            self.download(url)
-
-        # wait a bit for downloads to finish
-        time.sleep(1)
-        num_tracks = len(tracks)
+        self.ledger.mark_queued(self.name, tracks)
+        self.http.copy_browser_session(self.driver)
+        downloads = {}
+        # start each download as soon as Bandcamp has prepared it, in whatever order they finish
+        with self.stats.timer("dispatch"):
+            for track in tqdm(self.resolve_download_links(tracks), total=len(tracks), unit="item"):
+                logging.debug(f"url: {track.url}")
+                downloads[self.http.submit(track)] = track
+
+        print_magenta("Waiting for downloads to finish...")
+        with self.stats.timer("completion_wait"):
+            results = self.http.wait(downloads)
+
+        num_tracks = self.record_downloads(tracks, results)
         self.total_files_downloaded += num_tracks
         return num_tracks
 
-    def get_tracks(self, number=0) -> list:
+    def get_tracks(self, number=0) -> list[Track]:
         # not needed
         return []
 
@@ -72,10 +95,35 @@ class Bandcamp(RecordPool):
         # not needed
         return False
 
+    def resolve_download_links(self, tracks: list[Track]) -> Iterator[Track]:
+        """Watch all download items at once and yield each track as soon as its download url is ready."""
+        items = [track.element for track in tracks]
+        pending = set(range(len(items)))
+        deadline = time.monotonic() + self.prepare_timeout
+        while pending:
+            # one script call checks every item, instead of waiting on each item in turn
+            links = self.driver.execute_script(READY_LINKS_SCRIPT, items)
+            for index in sorted(pending):
+                if links[index]:
+                    pending.discard(index)
+                    tracks[index].url = links[index]
+                    yield tracks[index]
+
+            if not pending:
+                break
+
+            if time.monotonic() > deadline:
+                msg = f"{len(pending)} items were not ready after waiting for {self.prepare_timeout} seconds"
+                logging.error(msg)
+                print_error(msg)
+                break
+
+            time.sleep(self.poll_interval)
+
     def prepare_pool(self):
         # expand downloads if needed
+        # the page is ready, so the expand element is already there if it is needed
         logging.info("Checking to expand downloads")
-        self.driver.implicitly_wait(10)
         elements = self.driver.find_elements(by=By.CLASS_NAME, value="bfd-download-dropdown")
         if elements:
             logging.info("Expanding downloads")
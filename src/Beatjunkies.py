@@ -1,25 +1,36 @@
 from selenium.webdriver.common.by import By
 
+from PageWaiter import selector_present
 from RecordPool import RecordPool
-from utils import Site
+from TrackRules import parse_url
+from utils import Site, Track
 
 
 class Beatjunkies(RecordPool):
     def __init__(self):
         super().__init__(Site.BEATJUNKIES)
-        self.url = "https://www.beatjunkies.com/record-pool/page/1/"
-
-    def get_tracks(self, number=0) -> list:
+        self.direct_download = True
+        self.base_url = "https://www.beatjunkies.com"
+        self.url = f"{self.base_url}/record-pool/page/1/"
+        self.ready_conditions = [selector_present(".widget.widget-beats.playlist")]
+
+    def get_tracks(self, number=0) -> list[Track]:
+        urls = self.get_links(".widget.widget-beats.playlist .glyphicon.glyphicon-arrow-down.icon-right.inline-exclude")
+        urls = urls[: self.check_watermark(urls)]
+        num = min(number, len(urls)) if number > 0 else len(urls)
         tracks = []
-        playlist = self.driver.find_element(By.CSS_SELECTOR, ".widget.widget-beats.playlist")
-        songs = playlist.find_elements(By.CSS_SELECTOR, ".glyphicon.glyphicon-arrow-down.icon-right.inline-exclude")
-        num = min(number, len(songs)) if number > 0 else len(songs)
-        for song in songs[:num]:
-            url = song.get_attribute("href")
-            if url:
-                tracks.append(url)
-
-        return tracks
+        for url in urls[:num]:
+            artist, title, version = parse_url(url)
+            tracks.append(Track(id=url, url=url, artist=artist, title=title, version=version))
+
+        return self.rules.select(tracks)
+
+    def is_logged_in(self) -> bool:
+        # WordPress sets this cookie for logged-in users
+        return any(cookie["name"].startswith("wordpress_logged_in") for cookie in self.driver.get_cookies())
+
+    def page_url(self, page_number: int) -> str:
+        return f"{self.base_url}/record-pool/page/{page_number}/"
 
     def next_page(self):
         self.current_page_number += 1
@@ -1,46 +1,81 @@
+import logging
 import random
 
+from collections.abc import Iterator
+
 from selenium.webdriver.common.by import By
 
 from colorprint import Color, get_color, print_bold, print_color, print_yellow
+from HttpDownloader import HttpDownloader
+from PageWaiter import selector_present
 from RecordPool import RecordPool
-from utils import Site
+from TrackRules import parse_url
+from utils import Site, Track
+
+# Returns the url and link text of every download link on a review page, the link text is the version name
+DOWNLOAD_LINKS_SCRIPT = """
+return Array.from(document.querySelectorAll(arguments[0]), element => {
+    const link = element.href ? element : element.querySelector("a[href]");
+    return link ? {url: link.href, text: element.innerText.trim()} : null;
+}).filter(Boolean);
+"""
+
+# Download links of a review page, which are shown after rating the song
+DOWNLOAD_LINKS = selector_present(".float_right.reviw_tdonw")
+# A review page has loaded when either the rating or the download links are shown
+REVIEW_PAGE = selector_present(".rating-stars, .float_right.reviw_tdonw")
 
 
 class DJCity(RecordPool):
     def __init__(self):
         super().__init__(Site.DJCITY)
-        self.url = "https://www.djcity.com/uk/digital/records.aspx?p=1"
+        self.direct_download = True
+        self.base_url = "https://www.djcity.com"
+        self.url = f"{self.base_url}/uk/digital/records.aspx?p=1"
+        self.ready_conditions = [selector_present(".float_left.page_left")]
 
         # pool specific
         self.filter = ""
         self.genres = ("hiphop", "house", "latin", "pop", "r&b", "reggae", "other")
         self.genre_map = dict(zip(self.genres, ("c1", "c2", "c3", "c4", "c5", "c6", "c8")))
-
-    def get_tracks(self, number=0) -> list:
-        playlist = self.driver.find_element(By.CSS_SELECTOR, ".float_left.page_left")
-        links = playlist.find_elements(By.CSS_SELECTOR, ".downloadBtn")
-        num = min(number, len(links)) if number > 0 else len(links)
-        track_links = [url for url in (link.get_attribute("href") for link in links[:num]) if url]
+        # Number of review pages loading at the same time
+        self.review_tabs = 4
+        # Genres given in the settings, otherwise asked from the user
+        self.selected_genres: list[str] | None = None
+
+    def configure(self, settings: dict):
+        super().configure(settings)
+        if "genres" in settings:
+            self.selected_genres = [genre.strip().lower() for genre in settings["genres"]]
+
+    def create_worker(self, http: HttpDownloader) -> RecordPool:
+        worker = super().create_worker(http)
+        worker.filter = self.filter
+        return worker
+
+    def get_tracks(self, number=0) -> list[Track]:
+        track_links = self.get_links(".float_left.page_left .downloadBtn")
+        track_links = track_links[: self.check_watermark(track_links)]
+        num = min(number, len(track_links)) if number > 0 else len(track_links)
+        track_links = track_links[:num]
+        # review pages where every file was downloaded on a previous run do not need to be visited again
+        finished = self.ledger.finished_pages(self.name, track_links)
+        track_links = [link for link in track_links if link not in finished]
 
         tracks = []
         total_pages = len(track_links)
-        for page, link in enumerate(track_links, 1):
+        for page, (link, page_tracks) in enumerate(self.resolve_review_pages(track_links), 1):
             print(f"{page} / {total_pages}", end="\r", flush=True)
-            self.driver.get(link)
-            # DJCity requires you to rate the song in order to download it
-            if self.driver.find_elements(By.CSS_SELECTOR, ".rating-stars"):
-                stars = self.driver.find_element(By.CSS_SELECTOR, ".rating-stars")
-                stars.find_element(By.CSS_SELECTOR, f'[data-value="{random.randint(3, 5)}"]').click()
-            else:
-                # already reviewed -> skip
+            if not page_tracks:
+                # the page did not show its download links, so it is visited again on the next run
+                logging.warning(f"No download links on review page: {link}")
                 continue
 
-            downloads = self.driver.find_elements(By.CSS_SELECTOR, ".float_right.reviw_tdonw")
-            for download in downloads:
-                url = download.find_element(By.CSS_SELECTOR, "a").get_attribute("href")
-                if url:
-                    tracks.append(url)
+            page_tracks = self.rules.select(page_tracks)
+            self.ledger.set_page_tracks(self.name, link, [track.id for track in page_tracks])
+            # start downloading while the remaining review pages are still loading
+            self.prefetch(page_tracks)
+            tracks.extend(page_tracks)
 
         return tracks
 
@@ -49,9 +84,12 @@ class DJCity(RecordPool):
         digit = [int(s) for s in link.split("=") if s.isdigit()]
         return digit[0] if digit else 1
 
+    def is_logged_in(self) -> bool:
+        return not self.driver.find_elements(By.LINK_TEXT, "Sign In")
+
     def next_page(self) -> bool:
         self.current_page_number += 1
-        url = f"https://www.djcity.com/uk/digital/records.aspx?p={self.current_page_number}{self.filter}"
+        url = self.page_url(self.current_page_number)
         if url == self.current_url:
             return False
 
@@ -59,31 +97,108 @@ class DJCity(RecordPool):
         self.current_url = self.driver.current_url
         return True
 
+    def page_url(self, page_number: int) -> str:
+        return f"{self.base_url}/uk/digital/records.aspx?p={page_number}{self.filter}"
+
     def prepare_pool(self):
         self.check_login()
         self.set_genre_filter()
 
+    def resolve_review_pages(self, links: list[str]) -> Iterator[tuple[str, list[Track]]]:
+        """
+        Rate the review pages and yield each page link with its download tracks as soon as it has been handled.
+
+        Several review pages are loaded at the same time in separate tabs,
+        so the next pages are already loading while the current one is being rated.
+        """
+        main_window = self.driver.current_window_handle
+        pending = list(links)
+        # window handle -> review page link
+        tabs: dict[str, str] = {}
+        try:
+            while pending or tabs:
+                while pending and len(tabs) < self.review_tabs:
+                    link = pending.pop(0)
+                    handles = set(self.driver.window_handles)
+                    # opening the tab from a script returns immediately, unlike driver.get which waits for the load
+                    self.driver.execute_script("window.open(arguments[0], '_blank')", link)
+                    new_handles = set(self.driver.window_handles) - handles
+                    tabs[new_handles.pop()] = link
+
+                # the oldest tab has had the most time to load, the others keep loading in the background
+                handle, link = next(iter(tabs.items()))
+                del tabs[handle]
+                self.driver.switch_to.window(handle)
+                try:
+                    tracks = self.review()
+                finally:
+                    self.driver.close()
+
+                if tracks is None:
+                    # not recorded in the ledger, so the page is visited again on the next run
+                    logging.warning(f"Review page did not load, skipping it until the next run: {link}")
+                    print_yellow(f"Review page did not load: {link}")
+                    continue
+
+                yield link, tracks
+        finally:
+            for handle in tabs:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+
+            self.driver.switch_to.window(main_window)
+
+    def review(self) -> list[Track] | None:
+        """
+        Rate the song on the currently open review page if needed, and return its download tracks.
+
+        Returns None if the page or its download links did not load.
+        """
+        if not self.waiter.wait(REVIEW_PAGE):
+            return None
+
+        # DJCity requires you to rate the song in order to download it.
+        # A song rated on an earlier run has no stars, and its downloads that did not finish are tried again.
+        stars = self.driver.find_elements(By.CSS_SELECTOR, ".rating-stars")
+        if stars:
+            stars[0].find_element(By.CSS_SELECTOR, f'[data-value="{random.randint(3, 5)}"]').click()
+
+        if not self.waiter.wait(DOWNLOAD_LINKS):
+            return None
+
+        tracks = []
+        for link in self.driver.execute_script(DOWNLOAD_LINKS_SCRIPT, ".float_right.reviw_tdonw"):
+            artist, title, version = parse_url(link["url"])
+            tracks.append(
+                Track(id=link["url"], url=link["url"], artist=artist, title=title, version=link["text"] or version)
+            )
+
+        return tracks
+
     # Extra methods:
     def check_login(self):
-        sign_in_element = self.driver.find_elements(by=By.LINK_TEXT("Sign In"))
-        if sign_in_element:
+        if not self.is_logged_in():
             print("Not logged in, doing sign-in...\n")
-            sign_in_element[0].click()
-            self.driver.find_element_by_id("ctl00_PageContent_ctl00_ctrlLogin_LoginButton").click()
+            self.driver.find_element(By.LINK_TEXT, "Sign In").click()
+            self.driver.find_element(By.ID, "ctl00_PageContent_ctl00_ctrlLogin_LoginButton").click()
             # Make sure we are on correct page after logging in
             if self.driver.current_url != self.url:
                 self.driver.get(self.url)
 
     def set_genre_filter(self):
         genres = ("hiphop", "house", "r&b", "pop", "other")
-        print_bold("Use default genres (y/n)?")
-        if input().lower() in ("n", "no", "0"):
-            print_bold("Choose genres:")
-            print_color("hiphop, house, r&b, latin, pop, reggae, other", Color.cyan)
-            genres = [genre for genre in (i.strip().lower() for i in input().split(",")) if genre in self.genres]
-            if not genres:
-                print("No genres specified, using all...")
-                return
+        if self.selected_genres is not None:
+            genres = [genre for genre in self.selected_genres if genre in self.genres]
+        elif not self.batch:
+            print_bold("Use default genres (y/n)?")
+            if input().lower() in ("n", "no", "0"):
+                print_bold("Choose genres:")
+                print_color("hiphop, house, r&b, latin, pop, reggae, other", Color.cyan)
+                genres = [genre for genre in (i.strip().lower() for i in input().split(",")) if genre in self.genres]
+
+        if not genres:
+            print("No genres specified, using all...")
+            return
 
         print(f"Genres: {get_color(', '.join(genres), Color.yellow)}")
         self.filter = "&f=ddfilter"
@@ -94,6 +209,5 @@ class DJCity(RecordPool):
             else:
                 print_yellow(f"Skipping invalid genre: '{genre}'")
 
-        self.current_url = f"https://www.djcity.com/uk/digital/records.aspx?p={self.current_page_number}"
-        self.current_url += self.filter
+        self.current_url = self.page_url(self.current_page_number)
         self.driver.get(self.current_url)
@@ -0,0 +1,122 @@
+import json
+import logging
+import re
+import time
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from urllib.parse import unquote
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+
+@dataclass
+class CapturedDownload:
+    """A download started by the browser, as seen in the DevTools events."""
+
+    url: str
+    filename: str = ""
+    size: int | None = None
+
+
+class DownloadCapture:
+    """
+    Find the real file url, size and filename of downloads started by clicking on a page.
+
+    Reads the DevTools network and page events from the ChromeDriver performance log,
+    which has to be enabled with 'enable' before the browser is started.
+    """
+
+    def __init__(self, driver: webdriver):
+        self.driver: webdriver = driver
+        # url -> download, in the order they were seen
+        self.downloads: dict[str, CapturedDownload] = {}
+        # downloads not yet returned by 'wait_for_download'
+        self.pending: list[CapturedDownload] = []
+
+    @staticmethod
+    def enable(options: webdriver.ChromeOptions):
+        """Turn on the performance log the events are read from."""
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    def poll(self) -> list[CapturedDownload]:
+        """Read new events from the browser and return the downloads that started since the last call."""
+        try:
+            entries = self.driver.get_log("performance")
+        except WebDriverException as e:
+            logging.warning(f"Could not read performance log: {e}")
+            return []
+
+        new = []
+        for entry in entries:
+            message = json.loads(entry["message"])["message"]
+            method = message.get("method")
+            params = message.get("params", {})
+            if method == "Page.downloadWillBegin":
+                download = self._add(params["url"], new)
+                download.filename = params.get("suggestedFilename") or download.filename
+            elif method == "Network.responseReceived":
+                response = params["response"]
+                headers = {key.lower(): value for key, value in response.get("headers", {}).items()}
+                disposition = headers.get("content-disposition", "")
+                # audio previews are streamed inline, only attachments are downloads
+                if "attachment" in disposition:
+                    download = self._add(response["url"], new)
+                    download.filename = download.filename or self._filename(disposition)
+                    if headers.get("content-length", "").isdigit():
+                        download.size = int(headers["content-length"])
+
+        for download in new:
+            logging.info(f"Captured download: {download.filename or download.url}")
+
+        self.pending.extend(new)
+        return new
+
+    def begin(self):
+        """Forget the downloads seen so far. Call right before the click that starts the next download."""
+        self.poll()
+        self.pending.clear()
+
+    def wait_for_download(
+        self,
+        timeout: float = 10.0,
+        poll_interval: float = 0.1,
+        match: Callable[[CapturedDownload], bool] | None = None,
+    ) -> CapturedDownload | None:
+        """
+        Wait for the next download accepted by the match to start and return it, or None on timeout.
+
+        Downloads the match does not accept are late events from earlier clicks, and are dropped.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.poll()
+            while self.pending:
+                download = self.pending.pop(0)
+                if match is None or match(download):
+                    return download
+
+                logging.warning(f"Ignoring download not started by the last click: {download.filename or download.url}")
+
+            time.sleep(poll_interval)
+
+        return None
+
+    def _add(self, url: str, new: list[CapturedDownload]) -> CapturedDownload:
+        """Return the download for the url, adding it to the new downloads if it has not been seen before."""
+        if url not in self.downloads:
+            self.downloads[url] = CapturedDownload(url)
+            new.append(self.downloads[url])
+
+        return self.downloads[url]
+
+    @staticmethod
+    def _filename(disposition: str) -> str:
+        if match := re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE):
+            return unquote(match.group(1).strip('"'))
+
+        if match := re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE):
+            return match.group(1)
+
+        return ""
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from collections.abc import Iterable
+from datetime import datetime
+
+from utils import Track, get_state_dir
+
+
+class DownloadLedger:
+    """Persistent record of downloaded tracks, so tracks are never fetched again on later runs."""
+
+    def __init__(self, path: str = ""):
+        self.path: str = path if path else os.path.join(get_state_dir(), "ledger.sqlite")
+        # Downloads finish in worker threads, so share the connection behind a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS downloads (
+                    pool TEXT NOT NULL,
+                    track_id TEXT NOT NULL,
+                    url TEXT,
+                    title TEXT,
+                    status TEXT NOT NULL,
+                    size INTEGER,
+                    path TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (pool, track_id)
+                )
+                """
+            )
+            # Pages that list several downloads, like DJCity review pages, with the track ids found on them
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    pool TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    track_ids TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (pool, url)
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    pool TEXT PRIMARY KEY,
+                    track_id TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+
+        logging.debug(f"Download ledger: {self.path}")
+
+    def downloaded(self, pool: str, ids: Iterable[str]) -> set[str]:
+        """Return the subset of given track ids that have already been downloaded from the pool."""
+        ids = list(ids)
+        found = set()
+        # SQLite limits the number of query parameters, so query in chunks
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT track_id FROM downloads WHERE pool = ? AND status = 'done' AND track_id IN ({placeholders})",
+                    (pool, *chunk),
+                ).fetchall()
+            found.update(row[0] for row in rows)
+
+        return found
+
+    def finished_pages(self, pool: str, urls: Iterable[str]) -> set[str]:
+        """
+        Return the subset of given page urls where every track found on the page has been downloaded.
+
+        Pages without any recorded tracks are never finished.
+        """
+        urls = list(urls)
+        pages = {}
+        for start in range(0, len(urls), 500):
+            chunk = urls[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT url, track_ids FROM pages WHERE pool = ? AND url IN ({placeholders})",
+                    (pool, *chunk),
+                ).fetchall()
+            pages.update((url, json.loads(track_ids)) for url, track_ids in rows)
+
+        done = self.downloaded(pool, (track_id for track_ids in pages.values() for track_id in track_ids))
+        return {
+            url for url, track_ids in pages.items() if track_ids and all(track_id in done for track_id in track_ids)
+        }
+
+    def set_page_tracks(self, pool: str, url: str, track_ids: list[str]):
+        """Record the tracks found on a page, so the page is skipped once all of them have been downloaded."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO pages (pool, url, track_ids, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (pool, url) DO UPDATE SET track_ids = excluded.track_ids, updated_at = excluded.updated_at
+                """,
+                (pool, url, json.dumps(track_ids), self._now()),
+            )
+
+    def filter_new(self, pool: str, tracks: list[Track]) -> list[Track]:
+        """Return only the tracks that have not been downloaded yet."""
+        known = self.downloaded(pool, (track.id for track in tracks))
+        if known:
+            logging.info(f"Skipping {len(known)} already downloaded tracks")
+
+        return [track for track in tracks if track.id not in known]
+
+    def mark_queued(self, pool: str, tracks: list[Track]):
+        """Record that the given tracks are about to be downloaded."""
+        now = self._now()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                """
+                INSERT INTO downloads (pool, track_id, url, title, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'queued', ?, ?)
+                ON CONFLICT (pool, track_id) DO UPDATE SET
+                    url = excluded.url, title = excluded.title, status = 'queued', updated_at = excluded.updated_at
+                """,
+                [(pool, track.id, track.url, track.title, now, now) for track in tracks],
+            )
+
+    def mark_done(self, pool: str, track_id: str, path: str = "", url: str = ""):
+        """Record a finished download with its final file path, size and file url if known."""
+        size = os.path.getsize(path) if path and os.path.exists(path) else None
+        self._set_status(pool, track_id, "done", size, path or None, url or None)
+
+    def mark_failed(self, pool: str, track_id: str):
+        """Record a failed download so it will be tried again on the next run."""
+        self._set_status(pool, track_id, "failed")
+
+    def move(self, pool: str, path: str, new_path: str):
+        """Update the file path of a download that has been moved."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE downloads SET path = ?, updated_at = ? WHERE pool = ? AND path = ?",
+                (new_path, self._now(), pool, path),
+            )
+
+    def get_watermark(self, pool: str) -> str:
+        """Return the id of the newest track seen on the previous run, or an empty string if there is none."""
+        with self._lock:
+            row = self._connection.execute("SELECT track_id FROM watermarks WHERE pool = ?", (pool,)).fetchone()
+
+        return row[0] if row else ""
+
+    def set_watermark(self, pool: str, track_id: str):
+        """Store the id of the newest track on the pool."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO watermarks (pool, track_id, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (pool) DO UPDATE SET track_id = excluded.track_id, updated_at = excluded.updated_at
+                """,
+                (pool, track_id, self._now()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _set_status(
+        self,
+        pool: str,
+        track_id: str,
+        status: str,
+        size: int | None = None,
+        path: str | None = None,
+        url: str | None = None,
+    ):
+        now = self._now()
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO downloads (pool, track_id, url, status, size, path, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (pool, track_id) DO UPDATE SET
+                    url = coalesce(excluded.url, url),
+                    status = excluded.status,
+                    size = coalesce(excluded.size, size),
+                    path = coalesce(excluded.path, path),
+                    updated_at = excluded.updated_at
+                """,
+                (pool, track_id, url, status, size, path, now, now),
+            )
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().isoformat(timespec="seconds")
@@ -0,0 +1,176 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import time
+
+from colorprint import print_warn
+from utils import Platform
+
+# Chrome writes downloads to a temporary file that is renamed when the download is complete
+TEMP_SUFFIXES = (".crdownload",)
+
+
+class _Inotify:
+    """Minimal inotify wrapper used to wake up as soon as files appear or get renamed in a directory."""
+
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd: int = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # Growing files are picked up by the periodic scan, so modify events are not needed
+        mask = self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_FROM | self.IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+
+    def wait(self, timeout: float):
+        """Block until there are directory events or the timeout expires."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                # drain events, the directory is rescanned anyway
+                while os.read(self.fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DownloadTracker:
+    """
+    Track browser downloads by watching the download directory.
+
+    Chrome downloads to a '.crdownload' temp file which grows while downloading,
+    and is renamed to the final filename when the download has finished.
+    Uses inotify on Linux to react immediately, and falls back to polling elsewhere.
+    """
+
+    def __init__(self, path: str, stall_timeout: float = 60.0, poll_interval: float = 0.5):
+        self.path: str = path
+        self.poll_interval: float = poll_interval
+        self.stall_timeout: float = stall_timeout
+
+        # temp file name -> (size, time of last size change)
+        self.active: dict[str, tuple[int, float]] = {}
+        self.expected: int = 0
+        self.finished: list[str] = []
+        self.known: set[str] = set()
+        self.stalled: set[str] = set()
+        self.started: int = 0
+
+        self._inotify: _Inotify | None = None
+        if Platform.get().is_linux():
+            try:
+                self._inotify = _Inotify(path)
+            except (OSError, AttributeError) as e:
+                logging.debug(f"inotify not available, polling download directory instead: {e}")
+
+        self.reset()
+
+    def reset(self):
+        """Start tracking from the current directory contents."""
+        self.active.clear()
+        self.expected = 0
+        self.finished.clear()
+        self.known = {name for name in self._scan() if not name.endswith(TEMP_SUFFIXES)}
+        self.stalled.clear()
+        self.started = 0
+
+    def expect_download(self):
+        """Register that one more download should start."""
+        self.expected += 1
+
+    def update(self):
+        """Scan download directory and report started, finished and stalled downloads."""
+        now = time.monotonic()
+        files = self._scan()
+        new_files = []
+        for name, size in files.items():
+            if name.endswith(TEMP_SUFFIXES):
+                if name not in self.active:
+                    self.active[name] = (size, now)
+                    self.started += 1
+                    logging.info(f"Download started: {name}")
+                elif size != self.active[name][0]:
+                    self.active[name] = (size, now)
+                    self.stalled.discard(name)
+                elif now - self.active[name][1] > self.stall_timeout and name not in self.stalled:
+                    self.stalled.add(name)
+                    logging.warning(f"Download stalled: {name}")
+                    print_warn(f"Download stalled: {name}")
+            elif name not in self.known:
+                self.known.add(name)
+                new_files.append(name)
+
+        renamed = [name for name in self.active if name not in files]
+        for name in renamed:
+            del self.active[name]
+            self.stalled.discard(name)
+
+        # small files can finish between scans without the temp file ever being seen
+        self.started += max(0, len(new_files) - len(renamed))
+        for name in new_files:
+            self.finished.append(name)
+            logging.info(f"Download finished: {name}")
+
+    def wait_for_start(self, timeout: float = 10.0) -> bool:
+        """Wait until all expected downloads have started. Returns false on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            self.update()
+            if self.started >= self.expected:
+                return True
+
+            if time.monotonic() > deadline:
+                return False
+
+            self._wait()
+
+    def wait_until_done(self, start_timeout: float = 10.0) -> list[str]:
+        """Wait until all expected downloads have finished or stalled, and return the finished filenames."""
+        if not self.wait_for_start(start_timeout):
+            missing = self.expected - self.started
+            logging.warning(f"{missing} downloads did not start")
+            print_warn(f"{missing} downloads did not start")
+
+        while len(self.active) > len(self.stalled):
+            self._wait()
+            self.update()
+
+        return list(self.finished)
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def _scan(self) -> dict[str, int]:
+        """Return the file names and sizes in the download directory."""
+        files = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        files[entry.name] = entry.stat().st_size
+                except FileNotFoundError:
+                    # renamed or removed while scanning
+                    continue
+
+        return files
+
+    def _wait(self):
+        if self._inotify:
+            self._inotify.wait(self.poll_interval)
+        else:
+            time.sleep(self.poll_interval)
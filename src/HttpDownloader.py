@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from urllib.parse import unquote, urlparse
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from selenium import webdriver
+from tqdm import tqdm
+from urllib3.exceptions import ReadTimeoutError
+
+from AdaptiveLimiter import AdaptiveLimiter
+from colorprint import print_red
+from RunStats import RunStats
+from utils import Track
+
+
+class HttpDownloader:
+    """Download files in parallel over pooled keep-alive connections, reusing the browser session."""
+
+    def __init__(
+        self,
+        download_path: str,
+        workers: int = 4,
+        stats: RunStats | None = None,
+        slots: threading.Semaphore | None = None,
+    ):
+        self.chunk_size: int = 64 * 1024
+        self.download_path: str = download_path
+        # Per-host concurrency that adapts to the server, and the retry budget for the run
+        self.limiter: AdaptiveLimiter = AdaptiveLimiter(workers)
+        self.max_attempts: int = 5
+        # Shared with the downloaders of other pools running at the same time, to limit the total transfers
+        self.slots: threading.Semaphore | None = slots
+        # A transfer that receives no data for this many seconds is treated as stalled
+        self.stall_timeout: int = 30
+        self.stats: RunStats | None = stats
+        self.timeout: int = 60
+        self.workers: int = workers
+
+        # retries are handled in 'download', so they can lower the concurrency and use the retry budget
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+
+        # Filenames claimed by running downloads, so parallel transfers never write to the same file
+        self._lock = threading.Lock()
+        self._reserved: set[str] = set()
+
+    def copy_browser_session(self, driver: webdriver):
+        """Copy cookies, user agent and referer from the browser so requests are authenticated like the browser."""
+        self.session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent")
+        self.session.headers["Referer"] = driver.current_url
+        self.load_cookies(driver.get_cookies())
+
+    def load_cookies(self, cookies: list[dict]):
+        """Add browser cookies to the session, for example from a saved login session."""
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", ""),
+                path=cookie.get("path", "/"),
+            )
+
+    def submit(self, track: Track) -> Future:
+        """Start downloading given track in the background."""
+        return self.executor.submit(self.download, track)
+
+    def download(self, track: Track) -> str:
+        """
+        Stream one file to disk and return the path it was saved to.
+
+        The data is written to a '.part' file named after the track id, with the expected size and ETag
+        stored next to it. An interrupted transfer continues from the end of the partial file with an HTTP Range
+        request, both on connection errors during this run and on the next run after a crash or Ctrl-C.
+        Failed transfers are retried with jittered exponential backoff while the retry budget lasts.
+        The file is only renamed to its final name once its length has been verified.
+        """
+        key = hashlib.sha1(track.id.encode()).hexdigest()[:16]
+        part_path = os.path.join(self.download_path, f".{key}.part")
+        host = self.limiter.host(track.url)
+        attempt = 0
+        # time spent transferring data over all attempts, without waiting for a slot or backing off
+        seconds = 0.0
+        while True:
+            host.acquire()
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            try:
+                with self.slots or nullcontext():
+                    start = time.perf_counter()
+                    try:
+                        filename = self._transfer(track.url, part_path)
+                    finally:
+                        seconds += time.perf_counter() - start
+            except requests.RequestException as e:
+                throttled = self._is_throttled(e)
+                host.release(failed=True, throttled=throttled)
+                attempt += 1
+                if not self._is_retryable(e) or attempt >= self.max_attempts or not self.limiter.use_retry():
+                    raise
+
+                delay = self.limiter.backoff(attempt, self._retry_after(e))
+                logging.warning(f"Transfer failed, retrying in {delay:.1f}s ({attempt}/{self.max_attempts}): {e}")
+                if self.stats:
+                    self.stats.add_time("backoff", delay)
+
+                # the next attempt resumes from the end of the partial file
+                time.sleep(delay)
+                continue
+            except BaseException:
+                host.release(failed=True)
+                raise
+
+            host.release(os.path.getsize(part_path) - offset)
+            break
+
+        path = self._reserve_path(filename)
+        try:
+            os.replace(part_path, path)
+        finally:
+            with self._lock:
+                self._reserved.discard(path)
+
+        os.remove(part_path + ".json")
+        if self.stats:
+            self.stats.add_time("transfer", seconds)
+            self.stats.add_file(os.path.basename(path), os.path.getsize(path), seconds)
+
+        logging.info(f"Downloaded: {os.path.basename(path)}")
+        return path
+
+    def download_all(self, tracks: list[Track]) -> list[tuple[Track, str]]:
+        """Download all given tracks in parallel and return the successful tracks with their file paths."""
+        return self.wait({self.submit(track): track for track in tracks})
+
+    def wait(self, downloads: dict[Future, Track]) -> list[tuple[Track, str]]:
+        """Wait for the given downloads to finish and return the successful tracks with their file paths."""
+        results = []
+        # tqdm creates a progress bar
+        for future in tqdm(as_completed(downloads), total=len(downloads), unit="file"):
+            track = downloads[future]
+            try:
+                results.append((track, future.result()))
+            except (requests.RequestException, OSError, ValueError) as e:
+                logging.error(f"Download failed: {track.title or track.url}: {e}")
+                print_red(f"Download failed: {e}")
+
+        return results
+
+    def close(self):
+        """Wait for running downloads and close connections."""
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def _transfer(self, url: str, part_path: str) -> str:
+        """Download url to the partial file, resuming from existing data if possible, and return the filename."""
+        meta_path = part_path + ".json"
+        meta = self._read_meta(part_path)
+        offset = os.path.getsize(part_path) if meta else 0
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            # only resume if the file on the server has not changed, otherwise the server sends the whole file
+            validator = meta.get("etag") or meta.get("last_modified")
+            if validator:
+                headers["If-Range"] = validator
+
+        with self.session.get(
+            url, headers=headers, stream=True, timeout=(self.timeout, self.stall_timeout)
+        ) as response:
+            if response.status_code == 416 and offset and offset == meta.get("size"):
+                # the previous run already got all the data
+                return meta["filename"]
+
+            if response.status_code == 416 or (response.status_code == 206 and self._range_start(response) != offset):
+                # the partial file can not be continued, start over
+                os.remove(part_path)
+                return self._transfer(url, part_path)
+
+            response.raise_for_status()
+            if response.headers.get("Content-Type", "").startswith("text/html"):
+                raise requests.HTTPError(f"Expected a file but got a web page: {url}", response=response)
+
+            if response.status_code == 206:
+                logging.info(f"Resuming download from {offset / (1024 * 1024):.1f} MB: {meta['filename']}")
+                mode = "ab"
+            else:
+                offset = 0
+                mode = "wb"
+                length = response.headers.get("Content-Length")
+                meta = {
+                    "url": url,
+                    "filename": self._filename(response),
+                    "size": int(length) if length and "Content-Encoding" not in response.headers else None,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+                # written to a temp file first, so an interrupted write never leaves a cut short file
+                with open(meta_path + ".tmp", "w") as file:
+                    json.dump(meta, file)
+
+                os.replace(meta_path + ".tmp", meta_path)
+
+            with open(part_path, mode) as file:
+                for chunk in response.iter_content(self.chunk_size):
+                    file.write(chunk)
+
+        size = os.path.getsize(part_path)
+        if meta["size"] is not None and size != meta["size"]:
+            raise requests.ConnectionError(f"Incomplete download, got {size} of {meta['size']} bytes: {url}")
+
+        return meta["filename"]
+
+    @staticmethod
+    def _read_meta(part_path: str) -> dict:
+        """Return the stored metadata of the partial file, or an empty dict if there is no usable partial download."""
+        meta_path = part_path + ".json"
+        if not os.path.exists(part_path) or not os.path.exists(meta_path):
+            return {}
+
+        try:
+            with open(meta_path) as file:
+                meta = json.load(file)
+
+            if not isinstance(meta, dict):
+                raise ValueError("not an object")
+
+            missing = [key for key in ("url", "filename", "size") if key not in meta]
+            if missing:
+                raise KeyError(", ".join(missing))
+        except (ValueError, KeyError) as e:
+            # the partial data can not be verified without the metadata, so start over
+            logging.warning(f"Invalid partial download metadata, starting over: {meta_path}: {e}")
+            os.remove(part_path)
+            os.remove(meta_path)
+            return {}
+
+        return meta
+
+    @staticmethod
+    def _is_retryable(error: requests.RequestException) -> bool:
+        """Connection problems and server errors are retried, other HTTP errors are not."""
+        if isinstance(error, requests.HTTPError):
+            return error.response is not None and (
+                error.response.status_code == 429 or error.response.status_code >= 500
+            )
+
+        return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+    @staticmethod
+    def _is_throttled(error: requests.RequestException) -> bool:
+        """Return true if the error means the server is overloaded or limiting the request rate."""
+        if isinstance(error, requests.HTTPError):
+            return error.response is not None and error.response.status_code in (429, 503)
+
+        if isinstance(error, requests.Timeout):
+            return True
+
+        # a stalled transfer raises the read timeout as a connection error while streaming the body
+        return isinstance(error, requests.ConnectionError) and any(
+            isinstance(arg, ReadTimeoutError) for arg in error.args
+        )
+
+    @staticmethod
+    def _retry_after(error: requests.RequestException) -> float:
+        """Return the delay in seconds requested in the Retry-After header, or zero if there is none."""
+        response = getattr(error, "response", None)
+        value = response.headers.get("Retry-After", "") if response is not None else ""
+        return float(value) if value.isdigit() else 0.0
+
+    @staticmethod
+    def _range_start(response: requests.Response) -> int:
+        """Return the start offset from the Content-Range header of a partial response."""
+        match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+        return int(match.group(1)) if match else -1
+
+    @staticmethod
+    def _filename(response: requests.Response) -> str:
+        """Get filename from the Content-Disposition header, or from the url if it is missing."""
+        disposition = response.headers.get("Content-Disposition", "")
+        if match := re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE):
+            name = unquote(match.group(1).strip('"'))
+        elif match := re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE):
+            name = match.group(1)
+        else:
+            name = unquote(os.path.basename(urlparse(response.url).path))
+
+        # Never allow a server supplied name to escape the download directory
+        name = re.sub(r'[\\/:*?"<>|]', "_", name).strip(" .")
+        return name or "download"
+
+    def _reserve_path(self, filename: str) -> str:
+        """Return a free file path for given filename, adding a number suffix like Chrome does if it exists."""
+        stem, extension = os.path.splitext(filename)
+        with self._lock:
+            path = os.path.join(self.download_path, filename)
+            number = 1
+            while path in self._reserved or os.path.exists(path):
+                path = os.path.join(self.download_path, f"{stem} ({number}){extension}")
+                number += 1
+
+            self._reserved.add(path)
+            return path
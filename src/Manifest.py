@@ -0,0 +1,127 @@
+import json
+import logging
+import threading
+
+from dataclasses import asdict, dataclass, fields
+
+from utils import Track
+
+
+@dataclass
+class ManifestEntry:
+    """One planned download in a manifest."""
+
+    pool: str
+    id: str
+    url: str
+    title: str = ""
+    version: str = ""
+    genre: str = ""
+    artist: str = ""
+    bpm: float | None = None
+    key: str = ""
+    # expected file size in bytes, if the pool showed it while planning
+    size: int | None = None
+    page: int = 0
+    # entries with a higher priority are fetched first
+    priority: int = 0
+
+    @classmethod
+    def from_track(cls, pool: str, track: Track, page: int = 0, size: int | None = None, priority: int = 0):
+        return cls(
+            pool=pool,
+            id=track.id,
+            url=track.url,
+            title=track.title,
+            version=track.version,
+            genre=track.genre,
+            artist=track.artist,
+            bpm=track.bpm,
+            key=track.key,
+            size=size,
+            page=page,
+            priority=priority,
+        )
+
+    def track(self) -> Track:
+        return Track(
+            id=self.id,
+            url=self.url,
+            title=self.title,
+            version=self.version,
+            genre=self.genre,
+            artist=self.artist,
+            bpm=self.bpm,
+            key=self.key,
+        )
+
+
+class ManifestWriter:
+    """
+    JSON Lines manifest of harvested tracks, written instead of downloading them.
+
+    One line per track, appended and flushed per page, so the manifest of an interrupted plan run is still usable.
+    The manifest can be fetched later on another machine without a browser, see 'read_manifests'.
+    """
+
+    def __init__(self, path: str, priority: int = 0):
+        self.path: str = path
+        self.priority: int = priority
+        self._lock = threading.Lock()
+
+    def write(self, pool: str, page: int, tracks: list[Track], sizes: dict[str, int] | None = None):
+        """Append the tracks from one page."""
+        sizes = sizes or {}
+        lines = [
+            json.dumps(asdict(ManifestEntry.from_track(pool, track, page, sizes.get(track.id), self.priority)))
+            for track in tracks
+        ]
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.writelines(line + "\n" for line in lines)
+
+        logging.info(f"Wrote {len(lines)} tracks from page {page} to manifest {self.path}")
+
+
+def read_manifests(paths: list[str], pools: list[str] | None = None) -> list[ManifestEntry]:
+    """
+    Read entries from the given manifests, optionally only for the given pools.
+
+    Entries for the same track or file url are only returned once, keeping the one with the highest priority,
+    or the first one if the priorities are equal. The entries are returned in priority order,
+    otherwise in the order they were harvested.
+    """
+    names = {field.name for field in fields(ManifestEntry)}
+    wanted = {pool.lower() for pool in pools} if pools else None
+    entries: list[ManifestEntry] = []
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+
+                try:
+                    data = json.loads(line)
+                    entry = ManifestEntry(**{key: value for key, value in data.items() if key in names})
+                except (TypeError, ValueError) as e:
+                    logging.warning(f"Skipping invalid manifest line {path}:{number}: {e}")
+                    continue
+
+                if entry.url and (wanted is None or entry.pool.lower() in wanted):
+                    entries.append(entry)
+
+    # stable sort, so equal priorities keep the harvest order and the first duplicate wins
+    entries.sort(key=lambda entry: -entry.priority)
+    seen: set[tuple[str, str] | str] = set()
+    unique = []
+    for entry in entries:
+        keys = ((entry.pool.lower(), entry.id), entry.url)
+        if any(key in seen for key in keys):
+            continue
+
+        seen.update(keys)
+        unique.append(entry)
+
+    if len(unique) < len(entries):
+        logging.info(f"Skipped {len(entries) - len(unique)} duplicate manifest entries")
+
+    return unique
@@ -0,0 +1,116 @@
+import logging
+import statistics
+import time
+
+from collections import defaultdict, deque
+from dataclasses import dataclass
+
+from selenium import webdriver
+from selenium.common.exceptions import JavascriptException, TimeoutException, WebDriverException
+
+# Records the time of the latest DOM change, installing the observer on the first call
+DOM_SETTLED_SCRIPT = """
+if (!window.__recordpoolObserver) {
+    window.__recordpoolLastMutation = performance.now();
+    window.__recordpoolObserver = new MutationObserver(() => window.__recordpoolLastMutation = performance.now());
+    window.__recordpoolObserver.observe(document, {childList: true, subtree: true, attributes: true});
+    return false;
+}
+return performance.now() - window.__recordpoolLastMutation > arguments[0];
+"""
+
+
+@dataclass
+class Condition:
+    """JavaScript check that returns true when the page is ready."""
+
+    name: str
+    script: str
+    args: tuple = ()
+
+
+def selector_present(selector: str) -> Condition:
+    """Ready when an element matching the CSS selector exists."""
+    return Condition(f"selector {selector}", "return document.querySelector(arguments[0]) !== null", (selector,))
+
+
+def selector_absent(selector: str) -> Condition:
+    """Ready when no element matches the CSS selector."""
+    return Condition(f"no selector {selector}", "return document.querySelector(arguments[0]) === null", (selector,))
+
+
+def dom_settled(quiet: float = 0.3) -> Condition:
+    """Ready when the DOM has not changed for the given number of seconds."""
+    return Condition("dom settled", DOM_SETTLED_SCRIPT, (quiet * 1000,))
+
+
+class PageWaiter:
+    """
+    Wait for page conditions with timeouts learned from earlier waits.
+
+    The timeout covers all the conditions of one wait, and is learned from the total duration of earlier waits
+    for the same conditions. Once there are enough samples it is set to a few times the slow end of the observed
+    durations, but never below the default, so conditions that are usually true right away do not end up
+    with a timeout that one slow page load exceeds.
+    This replaces the implicit wait, so element lookups where absence is expected return immediately.
+    """
+
+    def __init__(
+        self,
+        driver: webdriver,
+        default_timeout: float = 10.0,
+        min_timeout: float = 10.0,
+        max_timeout: float = 60.0,
+        poll_interval: float = 0.05,
+    ):
+        self.default_timeout: float = default_timeout
+        self.driver: webdriver = driver
+        self.max_timeout: float = max_timeout
+        self.min_timeout: float = min_timeout
+        self.poll_interval: float = poll_interval
+        # names of the waited conditions -> recent successful wait times
+        self.timings: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=50))
+
+    def timeout(self, name: str) -> float:
+        """Return the timeout for the named conditions based on the earlier wait times."""
+        samples = self.timings[name]
+        if len(samples) < 5:
+            return self.default_timeout
+
+        slow = statistics.quantiles(samples, n=20)[-1]
+        return max(self.min_timeout, min(self.max_timeout, 3 * slow))
+
+    def wait(self, *conditions: Condition, timeout: float | None = None) -> bool:
+        """Wait until all conditions are true, in the given order. Returns false on timeout."""
+        name = " + ".join(condition.name for condition in conditions)
+        limit = timeout if timeout is not None else self.timeout(name)
+        start = time.monotonic()
+        for condition in conditions:
+            while not self._check(condition):
+                elapsed = time.monotonic() - start
+                if elapsed > limit:
+                    logging.warning(f"Timed out waiting for {condition.name} after {elapsed:.1f}s")
+                    return False
+
+                time.sleep(self.poll_interval)
+
+        self.timings[name].append(time.monotonic() - start)
+        return True
+
+    def require(self, *conditions: Condition):
+        """Wait until all conditions are true, trying once more with the longest timeout before raising."""
+        if self.wait(*conditions) or self.wait(*conditions, timeout=self.max_timeout):
+            return
+
+        names = ", ".join(condition.name for condition in conditions)
+        raise TimeoutException(f"Page did not get ready: {names}: {self.driver.current_url}")
+
+    def _check(self, condition: Condition) -> bool:
+        try:
+            return bool(self.driver.execute_script(condition.script, *condition.args))
+        except JavascriptException:
+            # the page was replaced while the script was running
+            return False
+        except WebDriverException as e:
+            logging.debug(f"Condition check failed: {condition.name}: {e}")
+            return False
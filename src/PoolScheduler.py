@@ -0,0 +1,84 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+from collections.abc import Callable
+
+from colorprint import Color, print_bold, print_color, print_red
+from RunStats import RunStats
+
+
+class PoolScheduler:
+    """
+    Run several pools at the same time, each in its own thread and browser.
+
+    The pools share a limit on the number of file transfers running at once, so together they use the same
+    bandwidth as a single pool, and a cached free disk space check for the download drives.
+    While one pool is waiting for a page to load, the transfer slots are used by the other pools.
+    """
+
+    def __init__(self, workers: int = 4, disk_check_interval: float = 5.0):
+        self.disk_check_interval: float = disk_check_interval
+        self.started: float = time.time()
+        # stats of the pools that have been added, for the combined summary
+        self.stats: list[RunStats] = []
+        # Limits the number of files downloading at the same time across all pools
+        self.transfer_slots: threading.BoundedSemaphore = threading.BoundedSemaphore(workers)
+        self.workers: int = workers
+        # device id -> time of the check and free megabytes
+        self._disk_cache: dict[int, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def add(self, name: str, target: Callable[[], RunStats | None]):
+        """Start running a pool. The target returns the pool stats, or None if the pool did not start."""
+        thread = threading.Thread(target=self._run, args=(name, target), name=name)
+        self._threads.append(thread)
+        thread.start()
+
+    def wait(self):
+        """Wait for all pools to finish and print the combined stats."""
+        for thread in self._threads:
+            thread.join()
+
+        self.print_stats()
+
+    def free_megabytes(self, path: str) -> float:
+        """Return the free space on the drive of the given path, checking the drive at most once per interval."""
+        device = os.stat(path).st_dev
+        with self._lock:
+            checked, free = self._disk_cache.get(device, (0.0, 0.0))
+            if time.monotonic() - checked > self.disk_check_interval:
+                free = shutil.disk_usage(path).free / (1024 * 1024)
+                self._disk_cache[device] = (time.monotonic(), free)
+
+            return free
+
+    def print_stats(self):
+        """Print the combined download statistics of all pools."""
+        total_files = sum(len(stats.files) for stats in self.stats)
+        total_size = sum(stats.total_bytes for stats in self.stats) / (1024 * 1024)
+        duration = time.time() - self.started
+        speed = total_size / duration if duration > 0 else 0.0
+        print("--------------------")
+        print_color("All pools", Color.cyan)
+        msg = f"Total files downloaded: {total_files} / {total_size:.1f} MB ({speed:.2f} MB/s)"
+        msg += f" from {len(self.stats)} pools in {duration:.0f}s"
+        logging.info(msg)
+        print(msg)
+
+    def _run(self, name: str, target: Callable[[], RunStats | None]):
+        try:
+            stats = target()
+        except Exception:
+            logging.exception(f"{name} failed")
+            print_red(f"{name} failed, see the log for details")
+            return
+
+        if stats:
+            with self._lock:
+                self.stats.append(stats)
+
+        print_bold(f"{name} finished")
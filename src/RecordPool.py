@@ -1,37 +1,139 @@
+import copy
 import logging
 import os
 import shutil
 import subprocess
-import time
+import tempfile
+import threading
+
+from concurrent.futures import Future
 
 from selenium import webdriver
 from selenium.common.exceptions import InvalidArgumentException
 from selenium.webdriver.chrome.service import Service as ChromeService
 from tqdm import tqdm
-from webdriver_manager.chrome import ChromeDriverManager
 
-from colorprint import Color, get_color, print_color, print_error_and_exit, print_magenta, print_red
-from utils import Platform, Site
+from blocking import blocked_urls
+from chromedriver import chromedriver_path
+from colorprint import (
+    Color,
+    get_color,
+    print_color,
+    print_error_and_exit,
+    print_magenta,
+    print_red,
+    print_yellow,
+)
+from DownloadCapture import CapturedDownload, DownloadCapture
+from DownloadLedger import DownloadLedger
+from DownloadTracker import DownloadTracker
+from HttpDownloader import HttpDownloader
+from Manifest import ManifestWriter
+from PageWaiter import Condition, PageWaiter
+from PoolScheduler import PoolScheduler
+from RunJournal import RunJournal
+from RunStats import RunStats
+from SessionStore import SessionStore
+from StagingArea import StagingArea
+from TrackRules import TrackRules
+from utils import Platform, Site, Track, get_state_dir
+
+# Returns the link of each element matching the CSS selector, or the link of its first child link element.
+# Reading the links in one script call avoids a separate WebDriver request for every element.
+LINKS_SCRIPT = """
+return Array.from(document.querySelectorAll(arguments[0]), element => {
+    const link = element.href ? element : element.querySelector("a[href]");
+    return link ? link.href : null;
+}).filter(Boolean);
+"""
 
 
 class RecordPool:
     """Parent class for all recordpool implementations."""
 
     def __init__(self, site: Site, download_folder_name: str = None):
+        # Never ask for user input
+        self.batch: bool = False
+        # Read the real file url and name of clicked downloads from the DevTools events
+        self.capture: DownloadCapture | None = None
+        self.capture_downloads: bool = False
+        # track id -> captured download
+        self.captured: dict[str, CapturedDownload] = {}
+        # Page resources that are never needed, see 'blocking.py'.
+        # The allowlist can contain categories or single patterns to remove from the blocked resources.
+        self.block_resources: list[str] = ["images", "fonts", "media", "trackers"]
+        self.allow_urls: list[str] = []
+        # Site address, can be changed in the settings to use a local copy of the site for benchmarking
+        self.base_url: str = ""
         self.current_page_number: int = 0
         self.current_url: str = ""
+        # Seconds between moving finished files from the staging directory to the library
+        self.commit_interval: float = 30.0
+        # Copy the browser cookies to the HTTP downloader for every page.
+        # Off for sharded workers, which share the downloader of the main pool that copies its session once.
+        self.copy_session: bool = True
+        # Address of an already running Chrome started with '--remote-debugging-port', like "127.0.0.1:9222"
+        self.debugger_address: str = ""
+        # Pools that return plain download urls from 'get_tracks' can skip the browser for the file transfers
+        self.direct_download: bool = False
+        self.download_workers: int = 4
         self.driver: webdriver = None
+        # Number of downloads that failed during the run
+        self.failed_downloads: int = 0
         self.folder: str = download_folder_name if download_folder_name else site.name
+        self.headless: bool = False
+        self.http: HttpDownloader | None = None
+        # Incremental mode stops at the newest track from the previous run (the watermark)
+        self.incremental: bool = False
+        self.journal: RunJournal = RunJournal(str(site))
+        self.ledger: DownloadLedger = DownloadLedger()
+        # Plan mode: harvested tracks are written to this manifest instead of being downloaded
+        self.manifest: ManifestWriter | None = None
+        # Directory for the exported run statistics, defaults to the state directory
+        self.metrics_dir: str = ""
         self.name = str(site)
+        self.newest_track: str = ""
         self.platform: Platform = Platform.get()
+        # Downloads started by 'prefetch' while the page is still being harvested.
+        # The pages are harvested and fetched on different threads in the pipelined loop, so use the lock.
+        self.prefetched: dict[str, Future] = {}
+        self.prefetch_lock = threading.Lock()
+        # Use a temporary copy of the Chrome profile so several browsers can run at the same time
+        self.profile_copy: bool = False
+        self.profile_copy_dir: str = ""
+        self.reached_watermark: bool = False
+        # Checks that tell when a pool page has finished loading, see 'PageWaiter.py'
+        self.ready_conditions: list[Condition] = []
+        # Number of failed file transfers that can be retried during the run
+        self.retry_budget: int = 30
+        # Saved login session, used to start from a fresh profile instead of the real Chrome profile
+        self.session: SessionStore = SessionStore(self.name)
+        # Settings given to 'configure', reused for the crawler workers
+        self.settings: dict = {}
+        # Downloads are written to a local staging directory and moved to the synced library when complete
+        self.staging: StagingArea | None = None
+        self.staging_dir: str = os.path.join(get_state_dir(), "staging")
+        self.use_staging: bool = True
+        self.use_session: bool = True
+        # Print and export run statistics on quit. Disabled for crawler workers, which add to the main pool stats.
+        self.report_stats: bool = True
+        # Track selection rules from the config, followed by the pool default rules, see 'TrackRules.py'
+        self.default_rules: list[dict] = []
+        self.rules: TrackRules = TrackRules()
+        # Shares transfer slots and disk space checks with other pools running at the same time
+        self.scheduler: PoolScheduler | None = None
         self.site: Site = site
+        self.stats: RunStats = RunStats(self.name)
         self.total_files_downloaded: int = 0
+        self.tracker: DownloadTracker | None = None
         self.url: str = ""
+        self.waiter: PageWaiter | None = None
+        self.watermark: str = ""
 
         # Setup log file and format
         logging.basicConfig(
             filename=f"{self.name}.log",
-            filemode="w",
+            filemode="a",
             level=logging.INFO,
             format="%(asctime)s [%(levelname)s] %(message)s",
             datefmt="%Y.%m.%d %H:%M:%S",
@@ -39,68 +141,225 @@ class RecordPool:
 
         # TODO: use Pathlib instead of os.path
         user_path = os.path.expanduser("~")
-        if self.platform.is_linux():
-            print_error_and_exit("Linux is not yet supported")
-
         if self.platform.is_mac():
             download_root = os.path.join(user_path, "Dropbox", "DJ MUSIC SORT")
-            chrome_profile = os.path.join(user_path, r"Library/Application Support/Google/Chrome")
+            self.chrome_profile = os.path.join(user_path, r"Library/Application Support/Google/Chrome")
         elif self.platform.is_windows():
             download_root = os.path.join("D:\\", "Dropbox", "DJ MUSIC SORT")
-            chrome_profile = os.path.join(user_path, "AppData\\Local\\Google\\Chrome\\User Data")
+            self.chrome_profile = os.path.join(user_path, "AppData\\Local\\Google\\Chrome\\User Data")
+        else:
+            download_root = os.path.join(user_path, "Music", "DJ MUSIC SORT")
+            self.chrome_profile = os.path.join(user_path, ".config", "google-chrome")
 
-        self.download_path = os.path.join(download_root, self.folder)
-        if not os.path.exists(self.download_path):
-            os.makedirs(self.download_path, exist_ok=True)
-
-        self.free_space_at_start, _ = self.free_disk_space()
+        # Environment variables override the platform defaults, and the settings override both
+        download_root = os.environ.get("RECORDPOOL_DOWNLOAD_ROOT", download_root)
+        self.chrome_profile = os.environ.get("RECORDPOOL_CHROME_PROFILE", self.chrome_profile)
 
         self.chrome_options = webdriver.ChromeOptions()
-        self.chrome_options.add_argument(f"user-data-dir={chrome_profile}")
         self.chrome_options.add_argument("profile-directory=Default")
         self.chrome_options.add_argument("disable-infobars")
         self.chrome_options.add_experimental_option(
             "prefs",
             {
-                "download.default_directory": self.download_path,
                 "download.prompt_for_download": False,
                 "download.directory_upgrade": True,
                 "safebrowsing.enabled": True,
             },
         )
+        self.set_download_path(os.path.join(download_root, self.folder))
+
+    def block_unused_resources(self):
+        """Stop the browser from loading images, fonts, audio previews and trackers the downloader does not use."""
+        urls = blocked_urls(self.block_resources, self.allow_urls)
+        if urls:
+            self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": urls})
+            logging.info(f"Blocking {len(urls)} url patterns: {', '.join(self.block_resources)}")
+
+    def check_watermark(self, ids: list[str]) -> int:
+        """
+        Return how many of the given track ids, in page order, are newer than the watermark.
+
+        In incremental mode, also remembers the first track seen as the new watermark.
+        """
+        if not self.incremental or not ids:
+            return len(ids)
+
+        if not self.newest_track:
+            self.newest_track = ids[0]
+
+        if self.watermark and self.watermark in ids:
+            self.reached_watermark = True
+            return ids.index(self.watermark)
+
+        return len(ids)
 
     def check_free_disk_space(self, limit_in_mb=1024) -> bool:
         """Check that there is more free disk space left than the given limit. Default is 1024 megabytes."""
+        if self.scheduler:
+            return self.scheduler.free_megabytes(self.download_path) > limit_in_mb
+
         free, ratio = self.free_disk_space()
         logging.debug(f"free disk space: {free:.1f} MB ({ratio:.1%})")
         return free > limit_in_mb
 
+    def configure(self, settings: dict):
+        """Apply settings from the command line or config file."""
+        # Override in site-specific child class to handle pool specific settings, and call super.
+        self.settings = settings
+        self.batch = settings.get("batch", self.batch)
+        if "block_resources" in settings:
+            self.block_resources = list(settings["block_resources"] or [])
+
+        # added to the pool defaults, which are needed for the pool to work
+        self.allow_urls = [*self.allow_urls, *settings.get("allow_urls", [])]
+        self.debugger_address = settings.get("debugger_address", self.debugger_address)
+        if settings.get("base_url"):
+            base_url = settings["base_url"].rstrip("/")
+            self.url = self.url.replace(self.base_url, base_url, 1)
+            self.base_url = base_url
+
+        self.download_workers = settings.get("workers", self.download_workers)
+        self.headless = settings.get("headless", self.headless)
+        if settings.get("download_root"):
+            self.set_download_path(os.path.join(os.path.expanduser(settings["download_root"]), self.folder))
+
+        if settings.get("chrome_profile"):
+            self.chrome_profile = os.path.expanduser(settings["chrome_profile"])
+
+        self.use_session = settings.get("session", self.use_session)
+        self.metrics_dir = settings.get("metrics_dir", self.metrics_dir)
+        self.retry_budget = settings.get("retry_budget", self.retry_budget)
+        self.use_staging = settings.get("staging", self.use_staging)
+        if settings.get("staging_dir"):
+            self.staging_dir = os.path.expanduser(settings["staging_dir"])
+
+        self.commit_interval = settings.get("commit_interval", self.commit_interval)
+        if settings.get("plan"):
+            self.manifest = ManifestWriter(os.path.expanduser(settings["plan"]), settings.get("priority", 0))
+        self.set_rules(settings.get("rules", []), settings.get("prefer_versions"))
+
+    def copy_profile(self) -> str:
+        """
+        Copy the parts of the Chrome profile needed for staying logged in to a temporary directory.
+
+        Chrome only allows one browser per profile, which is why a second browser fails with "Chrome already running".
+        """
+        self.profile_copy_dir = tempfile.mkdtemp(prefix=f"{self.name}-profile-")
+        # 'Local State' contains the key for decrypting cookies on Windows
+        for name in (
+            "Local State",
+            "Default/Cookies",
+            "Default/Network",
+            "Default/Local Storage",
+            "Default/Preferences",
+        ):
+            source = os.path.join(self.chrome_profile, name)
+            target = os.path.join(self.profile_copy_dir, name)
+            try:
+                if os.path.isdir(source):
+                    shutil.copytree(source, target)
+                elif os.path.isfile(source):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copy2(source, target)
+            except OSError as e:
+                # files that are locked by a running Chrome can not always be copied
+                logging.warning(f"Could not copy profile file '{name}': {e}")
+
+        return self.profile_copy_dir
+
+    def create_http_downloader(self) -> HttpDownloader:
+        """Create a downloader for the pool, limited by the shared transfer slots when run with other pools."""
+        slots = self.scheduler.transfer_slots if self.scheduler else None
+        http = HttpDownloader(self.download_path, self.download_workers, self.stats, slots)
+        http.limiter.retry_budget = self.retry_budget
+        return http
+
+    def create_worker(self, http: HttpDownloader) -> "RecordPool":
+        """Create a headless copy of this pool for crawling pages in parallel, sharing the given downloader."""
+        worker = type(self)()
+        worker.configure(self.settings)
+        # workers run in the background, each in its own headless browser
+        worker.batch = True
+        worker.copy_session = False
+        worker.debugger_address = ""
+        worker.headless = True
+        worker.profile_copy = True
+        worker.report_stats = False
+        # shared with the main pool
+        worker.http = http
+        worker.manifest = self.manifest
+        worker.scheduler = self.scheduler
+        worker.staging = self.staging
+        if self.staging:
+            worker.download_path = self.download_path
+        worker.stats = self.stats
+        return worker
+
     def download_page(self, num_to_download=0) -> int:
         """Download all main files on current page, or optionally only the "num_to_download" first tracks."""
-        if not self.check_free_disk_space():
-            raise OSError("Disk is full!")
+        return self.fetch(self.harvest_page(num_to_download))
 
-        print_magenta("Getting download links...")
-        tracks = self.get_tracks(num_to_download)
+    def fetch(self, tracks: list[Track]) -> int:
+        """Download the given tracks and return the number of downloaded files."""
         if not tracks:
-            print_red("No files to download!\n")
             return 0
 
+        if self.manifest:
+            return self.write_manifest(tracks)
+
         print_magenta("Downloading files...")
-        # tqdm creates a progress bar
-        for track in tqdm(tracks):
-            self.download(track)
+        self.ledger.mark_queued(self.name, tracks)
+        self.journal.queued(tracks)
+        if self.direct_download:
+            # tracks that were already started while harvesting the page are not downloaded again
+            downloads = {}
+            with self.stats.timer("dispatch"), self.prefetch_lock:
+                for track in tracks:
+                    future = self.prefetched.pop(track.id, None)
+                    downloads[future if future else self.http.submit(track)] = track
+
+            with self.stats.timer("completion_wait"):
+                results = self.http.wait(downloads)
+
+            num_tracks = self.record_downloads(tracks, results)
+        else:
+            self.tracker.reset()
+            # tqdm creates a progress bar
+            for track in tqdm(tracks):
+                with self.stats.timer("dispatch"):
+                    self.download(track)
+
+            print_magenta("Waiting for downloads to finish...")
+            with self.stats.timer("completion_wait"):
+                finished = self.tracker.wait_until_done()
+
+            paths = [os.path.join(self.download_path, name) for name in finished]
+            paths = [path for path in paths if os.path.exists(path)]
+            # the browser does not report transfer times, so only the file sizes are recorded
+            for path in paths:
+                self.stats.add_file(os.path.basename(path), os.path.getsize(path))
+
+            num_tracks = self.record_browser_downloads(tracks, paths)
+            if self.staging:
+                for path in paths:
+                    self.staging.add(path)
 
-        # wait a bit for downloads to finish
-        time.sleep(2)
-        num_tracks = len(tracks)
         self.total_files_downloaded += num_tracks
         return num_tracks
 
-    def download(self, track):
+    def download(self, track: Track):
         """Download one track."""
         # Default implementation. Override if needed.
-        self.driver.get(track)
+        self.driver.get(track.url)
+        self.tracker.expect_download()
+
+    def enable_incremental(self):
+        """Only download tracks added since the previous run."""
+        self.incremental = True
+        self.newest_track = ""
+        self.reached_watermark = False
+        self.watermark = self.ledger.get_watermark(self.name)
 
     def free_disk_space(self) -> tuple[int, float]:
         """Returns free disk space in download path as a tuple of megabytes and ratio of free space left."""
@@ -109,6 +368,10 @@ class RecordPool:
         free_ratio = free / total
         return free_mb, free_ratio
 
+    def get_links(self, selector: str) -> list[str]:
+        """Return the links for all elements matching the given CSS selector on the current page."""
+        return self.driver.execute_script(LINKS_SCRIPT, selector)
+
     def get_page_number(self) -> int:
         """Get the current page number."""
         # Default implementation. Override if needed.
@@ -116,11 +379,43 @@ class RecordPool:
         page = digits[0] if digits else 1
         return page
 
-    def get_tracks(self, number=0) -> list:
+    def page_url(self, page_number: int) -> str:
+        """Return the url for the given page number."""
+        # Override in site-specific child class if pages can be opened directly.
+        raise NotImplementedError
+
+    def get_tracks(self, number=0) -> list[Track]:
         """Return a list of track objects that can be downloaded."""
         # Override in site-specific child class.
         raise NotImplementedError
 
+    def harvest_page(self, num_to_download=0) -> list[Track]:
+        """Get the tracks to download from the current page, skipping tracks that have already been downloaded."""
+        if not self.check_free_disk_space():
+            raise OSError("Disk is full!")
+
+        if self.direct_download and self.copy_session:
+            # Session cookies can change while browsing, so copy them again for every page.
+            # Done here since the browser must only be used from the thread that is harvesting pages.
+            self.http.copy_browser_session(self.driver)
+
+        print_magenta("Getting download links...")
+        with self.stats.timer("link_harvest"):
+            tracks = self.get_tracks(num_to_download)
+
+        tracks = self.ledger.filter_new(self.name, tracks)
+        self.journal.page(self.current_page_number, self.current_url, tracks)
+        if not tracks:
+            print_red("No files to download!\n")
+            return []
+
+        return tracks
+
+    def is_logged_in(self) -> bool:
+        """Return false if the pool is showing a login page or otherwise requires logging in."""
+        # Override in site-specific child class if the pool requires a login.
+        return True
+
     def next_page(self) -> bool:
         """Load next page, or return false if there are no more pages available."""
         # Override in site-specific child class.
@@ -128,46 +423,250 @@ class RecordPool:
 
     def open_page(self, url):
         """Open given url."""
-        self.driver.get(url)
+        with self.stats.timer("page_load"):
+            self.driver.get(url)
+            self.wait_until_ready()
+
         self.update_current_page()
 
     def prepare_pool(self):
         """Additional pool setup if needed, such as selecting genres."""
         pass
 
+    def prefetch(self, tracks: list[Track]):
+        """
+        Start downloading tracks right away, before the rest of the page has been harvested.
+
+        At most as many prefetched downloads as there are download workers are running at once,
+        so the harvest can not queue up downloads past the pipeline limit on pages waiting to be fetched.
+        The other tracks are downloaded when the page is fetched.
+        """
+        if not self.direct_download or self.manifest:
+            return
+
+        tracks = self.ledger.filter_new(self.name, tracks)
+        with self.prefetch_lock:
+            running = sum(not future.done() for future in self.prefetched.values())
+            for track in tracks:
+                if running >= self.http.workers:
+                    break
+
+                if track.id not in self.prefetched:
+                    self.prefetched[track.id] = self.http.submit(track)
+                    running += 1
+
     def print_stats(self):
         """Print download statistics."""
         print("--------------------")
         print_color(self.name, Color.cyan)
-        free_space, _ = self.free_disk_space()
-        total_size = self.free_space_at_start - free_space
+        total_size = self.stats.total_bytes / (1024 * 1024)
         msg = f"Total files downloaded: {self.total_files_downloaded} / {total_size:.1f} MB"
+        msg += f" ({self.stats.megabytes_per_second():.2f} MB/s)"
         logging.info(msg)
-        print(msg, end="\n\n")
+        print(msg)
+        for phase, summary in self.stats.summary()["phases"].items():
+            msg = f"{phase}: {summary['total']:.1f}s total, {summary['mean']:.2f}s mean ({summary['count']})"
+            logging.info(msg)
+            print(msg)
+
+        print()
+
+    def record_downloads(self, tracks: list[Track], results: list[tuple[Track, str]]) -> int:
+        """Save finished and failed downloads to the ledger and return the number of finished downloads."""
+        finished = set()
+        for track, path in results:
+            self.ledger.mark_done(self.name, track.id, path)
+            self.journal.done(track, path)
+            finished.add(track.id)
+            if self.staging:
+                self.staging.add(path)
+
+        for track in tracks:
+            if track.id not in finished:
+                self.ledger.mark_failed(self.name, track.id)
+                self.failed_downloads += 1
+                self.journal.failed(track)
+
+        return len(finished)
+
+    def record_browser_downloads(self, tracks: list[Track], paths: list[str]) -> int:
+        """
+        Save clicked downloads to the ledger and return the number of finished downloads.
+
+        Tracks are matched to the finished files by the captured filename. Tracks without a matching file
+        are only counted as finished if there are enough other finished files for all of them,
+        otherwise they are marked as failed, since there is no way to tell which ones did not download.
+        """
+        unmatched = set(paths)
+        pending = []
+        num_tracks = 0
+        for track in tracks:
+            captured = self.captured.pop(track.id, None)
+            path = os.path.join(self.download_path, captured.filename) if captured and captured.filename else ""
+            if path in unmatched:
+                unmatched.discard(path)
+                self.ledger.mark_done(self.name, track.id, path, captured.url)
+                self.journal.done(track, path)
+                num_tracks += 1
+            else:
+                pending.append((track, captured))
+
+        all_finished = len(unmatched) >= len(pending)
+        for track, captured in pending:
+            if all_finished:
+                self.ledger.mark_done(self.name, track.id, url=captured.url if captured else "")
+                self.journal.done(track)
+                num_tracks += 1
+            else:
+                self.ledger.mark_failed(self.name, track.id)
+                self.failed_downloads += 1
+                self.journal.failed(track)
+
+        return num_tracks
 
     def reload_page(self):
         """Reload currently stored page url."""
         self.driver.get(self.current_url)
+        self.wait_until_ready()
+
+    def save_watermark(self):
+        """Store the newest track from this run so the next incremental run stops there."""
+        # failed tracks are older than the new watermark, so moving it would skip them on later incremental runs
+        if self.failed_downloads:
+            logging.warning(f"Not saving watermark, {self.failed_downloads} downloads failed")
+            print_yellow(f"{self.failed_downloads} downloads failed, the next run starts from the same tracks")
+            return
+
+        # a planned run has not downloaded anything yet
+        if self.newest_track and not self.manifest:
+            self.ledger.set_watermark(self.name, self.newest_track)
+            logging.info(f"Saved watermark: {self.newest_track}")
+
+    def set_download_path(self, path: str):
+        """Download files to the given library directory, creating it if needed."""
+        self.library_path = path
+        self.download_path = path
+        os.makedirs(self.download_path, exist_ok=True)
+        self.chrome_options.experimental_options["prefs"]["download.default_directory"] = self.download_path
+
+    def start_staging(self):
+        """Download to the staging directory from now on, if it is enabled and on the same drive as the library."""
+        if not self.use_staging or self.staging:
+            return
+
+        path = os.path.join(self.staging_dir, self.folder)
+        if not StagingArea.same_filesystem(path, self.library_path):
+            msg = f"Staging directory '{path}' is not on the same drive as the library, downloading directly"
+            logging.warning(msg)
+            print_yellow(msg)
+            return
+
+        self.staging = StagingArea(path, self.library_path, self.commit_interval, self._staged_file_moved)
+        self.staging.start()
+        self.download_path = path
+        self.chrome_options.experimental_options["prefs"]["download.default_directory"] = self.download_path
+        logging.info(f"Staging downloads in '{path}'")
+
+    def set_rules(self, rules: list[dict], prefer_versions: list[str] | None = None):
+        """Compile the given track selection rules, which are checked before the pool default rules."""
+        self.rules = TrackRules([*rules, *self.default_rules], prefer_versions)
+
+    def set_download_behavior(self, allow: bool = True):
+        """Allow or deny browser downloads to the download directory."""
+        # Headless Chrome and an attached browser do not use the download directory from the preferences
+        behavior = {"behavior": "allow", "downloadPath": self.download_path} if allow else {"behavior": "deny"}
+        self.driver.execute_cdp_cmd("Browser.setDownloadBehavior", behavior)
 
     def set_start_page(self, page_number):
         """Set current page number to given number."""
         self.current_page_number = page_number
 
-    def start_driver(self):
+    def start_driver(self, prepare: bool = True):
         """Open webdriver and prepare pool for downloading."""
         print_magenta("Starting ChromeDriver...")
-        try:
-            self.driver = webdriver.Chrome(
-                service=ChromeService(ChromeDriverManager().install()), options=self.chrome_options
+        self.start_staging()
+        restore_session = self.use_session and not self.debugger_address and self.session.available()
+        if self.debugger_address:
+            # the running browser already has its profile and settings, so only the address can be given
+            options = webdriver.ChromeOptions()
+            options.add_experimental_option("debuggerAddress", self.debugger_address)
+        else:
+            options = copy.deepcopy(self.chrome_options)
+            if restore_session:
+                # an empty profile starts faster, and does not conflict with a running Chrome
+                self.profile_copy_dir = tempfile.mkdtemp(prefix=f"{self.name}-profile-")
+                profile = self.profile_copy_dir
+            else:
+                profile = self.copy_profile() if self.profile_copy else self.chrome_profile
+
+            options.add_argument(f"user-data-dir={profile}")
+            # a Linux server has no display to open a browser window on
+            headless = self.headless or (
+                self.platform.is_linux() and not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY")
             )
-            self.driver.implicitly_wait(0.5)
-            self.driver.get(self.url)
+            if headless:
+                options.add_argument("--headless=new")
+
+            if self.platform.is_linux():
+                # containers often have a tiny /dev/shm, which makes Chrome crash on large pages
+                options.add_argument("--disable-dev-shm-usage")
+
+            if self.capture_downloads:
+                DownloadCapture.enable(options)
+
+            blocks_images = "images" in self.block_resources and "images" not in self.allow_urls
+            if blocks_images and profile != self.chrome_profile:
+                # Unlike the blocked urls, this also applies to new tabs opened by the pool.
+                # Chrome saves it in the profile, so it is never set for the real profile of the user.
+                options.experimental_options["prefs"]["profile.managed_default_content_settings.images"] = 2
+
+        try:
+            with self.stats.timer("driver_start"):
+                self.driver = webdriver.Chrome(service=ChromeService(chromedriver_path()), options=options)
+                # Lookups return immediately, waiting is done explicitly with the page waiter
+                self.driver.implicitly_wait(0)
+                self.waiter = PageWaiter(self.driver)
+                if self.debugger_address:
+                    print(f"Attached to Chrome at {self.debugger_address}")
+
+                self.set_download_behavior()
+                self.block_unused_resources()
+                if self.capture_downloads:
+                    self.capture = DownloadCapture(self.driver)
+
+                if restore_session:
+                    self.session.restore(self.driver)
+
+            with self.stats.timer("page_load"):
+                self.driver.get(self.url)
+                # an expired session shows the login page instead, which is checked below
+                self.wait_until_ready(required=False)
+
             self.current_url = self.driver.current_url
         except InvalidArgumentException:
             print_error_and_exit("\nError: Chrome already running. Close Chrome and try again...")
 
+        if restore_session and not self.is_logged_in():
+            print_yellow("Saved session has expired, logging in again with the Chrome profile...")
+            logging.info("Saved session has expired")
+            self.session.clear()
+            self.driver.quit()
+            self.driver = None
+            shutil.rmtree(self.profile_copy_dir, ignore_errors=True)
+            self.profile_copy_dir = ""
+            return self.start_driver(prepare)
+
+        if self.direct_download:
+            if not self.http:
+                self.http = self.create_http_downloader()
+        else:
+            self.tracker = DownloadTracker(self.download_path)
+
         print(f"\n{repr(self)}")
-        self.prepare_pool()
+        if prepare:
+            self.prepare_pool()
+            if self.use_session and not self.debugger_address and self.is_logged_in():
+                self.session.save(self.driver)
 
     def update_current_page(self):
         """Update page variables (url and page number) to match currently loaded page."""
@@ -176,20 +675,75 @@ class RecordPool:
 
     def quit(self):
         """Close driver and print download stats."""
+        if self.http:
+            self.http.close()
+            self.http = None
+
+        if self.tracker:
+            self.tracker.close()
+            self.tracker = None
+
+        if self.staging:
+            self.staging.close()
+            self.staging = None
+
+        self.ledger.close()
+
         if self.driver:
             self.driver.quit()
-            self.print_stats()
+            self.driver = None
+            if self.report_stats:
+                self.print_stats()
+                try:
+                    self.stats.export(self.metrics_dir)
+                except OSError as e:
+                    logging.error(f"Could not export run stats: {e}")
+
+        if self.profile_copy_dir:
+            shutil.rmtree(self.profile_copy_dir, ignore_errors=True)
+            self.profile_copy_dir = ""
 
     def system_name(self) -> str:
         """Returns a formatted string for the platform name."""
         return repr(self.platform)
 
     def open_downloads_directory(self):
-        print(f"Opening downloads dir: {get_color(self.download_path, Color.yellow)}")
+        if self.staging:
+            self.staging.commit()
+
+        print(f"Opening downloads dir: {get_color(self.library_path, Color.yellow)}")
         if self.platform == Platform.MAC:
-            subprocess.run(["open", "--", self.download_path])
+            subprocess.run(["open", "--", self.library_path])
         elif self.platform == Platform.WINDOWS:
-            subprocess.run(["explorer", self.download_path])
+            subprocess.run(["explorer", self.library_path])
+        elif shutil.which("xdg-open") and (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+            subprocess.run(["xdg-open", self.library_path])
+
+    def write_manifest(self, tracks: list[Track]) -> int:
+        """Write the tracks to the plan manifest instead of downloading them. Returns zero downloaded files."""
+        sizes = {track_id: captured.size for track_id, captured in self.captured.items() if captured.size}
+        self.manifest.write(self.name, self.current_page_number, tracks, sizes)
+        for track in tracks:
+            self.captured.pop(track.id, None)
+
+        print_magenta(f"Planned {len(tracks)} tracks to {self.manifest.path}")
+        return 0
+
+    def wait_until_ready(self, required: bool = True) -> bool:
+        """
+        Wait until the current page has finished loading according to the pool ready conditions.
+
+        A required page that does not get ready raises a TimeoutException, so a slow page is not taken as empty.
+        Otherwise returns false on timeout.
+        """
+        if not required:
+            return self.waiter.wait(*self.ready_conditions)
+
+        self.waiter.require(*self.ready_conditions)
+        return True
+
+    def _staged_file_moved(self, path: str, library_path: str):
+        self.ledger.move(self.name, path, library_path)
 
     def __str__(self):
         return self.name
@@ -4,48 +4,116 @@ Akseli Lukkarila
 2019
 """
 
+import argparse
 import logging
 import os
+import queue
+import shutil
+import subprocess
 import sys
 import threading
 import traceback
 
+from concurrent.futures import Future
+
 from Bandcamp import Bandcamp
 from Beatjunkies import Beatjunkies
 from BPMSupreme import BPMSupreme
-from colorprint import print_bold, print_cyan, print_error, print_error_and_exit, print_red, print_yellow
+from colorprint import (
+    print_bold,
+    print_cyan,
+    print_error,
+    print_error_and_exit,
+    print_magenta,
+    print_red,
+    print_yellow,
+)
+from config import default_config_path, load_config, pool_settings
 from DJCity import DJCity
+from Manifest import ManifestEntry, read_manifests
+from PoolScheduler import PoolScheduler
 from RecordPool import RecordPool
-from utils import Site
+from RunStats import RunStats
+from ShardedCrawler import ShardedCrawler
+from utils import Platform, Site, Track
+
+LINUX_NOTIFICATION_SOUND = "/usr/share/sounds/freedesktop/stereo/complete.oga"
 
 
 class RecordPoolDownloader:
     """Command line tool for recordpool web downloads."""
 
-    def __init__(self, site: Site, url=""):
-        if site == Site.BEATJUNKIES:
-            self.pool = Beatjunkies()
-        elif site == Site.BPMSUPREME:
-            self.pool = BPMSupreme()
-        elif site == Site.DJCITY:
-            self.pool = DJCity()
-        elif site == Site.BANDCAMP:
-            self.pool = Bandcamp(url)
-        else:
-            raise RuntimeError(f"Unsupported record pool: {site}")
+    def __init__(self, site: Site, url="", settings: dict | None = None, scheduler: PoolScheduler | None = None):
+        self.pool: RecordPool = create_pool(site, url)
+        self.settings: dict = settings if settings else {}
+        # Never ask for user input
+        self.batch: bool = self.settings.get("batch", False)
+        # Number of harvested pages that can wait for downloading before the browser stops to wait
+        self.pipeline_depth = 2
+        # Incremental runs stop after this many pages if the tracks from the previous run are not found
+        self.max_incremental_pages: int = self.settings.get("pages") or 20
+        self.tracks_per_page: int = self.settings.get("tracks", 0)
+        self.pool.configure(self.settings)
+        if scheduler:
+            # the browsers of the other pools are running at the same time, so each needs its own profile
+            self.pool.scheduler = scheduler
+            self.pool.profile_copy = True
 
         self.pool.start_driver()
         logging.info(f"Initialized {self.pool} on {self.pool.system_name()}")
         logging.info(f"Download path: '{self.pool.download_path}'")
 
+    def run(self):
+        """Run the mode given in the settings, or ask for the mode if there is none."""
+        if self.settings.get("resume") and self.resume():
+            return
+
+        start_page = self.settings.get("start_page", 1)
+        pages = self.settings.get("pages", 0)
+        browsers = self.settings.get("browsers", 1)
+        if start_page > 1 and browsers <= 1:
+            try:
+                self.pool.open_page(self.pool.page_url(start_page))
+            except NotImplementedError:
+                print_yellow(f"{self.pool} can not open page {start_page} directly, starting from the first page")
+
+        if self.settings.get("new"):
+            self.incremental_loop()
+        elif browsers > 1:
+            self.sharded_loop(start_page, start_page + max(pages, 1) - 1, browsers)
+        elif pages > 0 or self.batch:
+            self.multi_page_loop(max(pages, 1))
+        else:
+            self.run_loop()
+
     def run_loop(self):
         """Start download loop with a specific mode."""
         print_bold("\nChoose mode:")
         print(" 0: Single page")
         print(">0: Multiple pages")
+        print(" n: New tracks since last run")
+        print(" p: Page range with parallel browsers")
+        answer = input().strip().lower()
+        print()
+        if answer == "n":
+            self.incremental_loop()
+            return
+
+        if answer == "p":
+            try:
+                first_page, last_page = (
+                    int(number) for number in input("Give page range, for example '1-20':\n").split("-")
+                )
+                browsers = int(input("Give number of browsers:\n") or 4)
+            except ValueError:
+                print_red("Invalid input")
+                return
+
+            self.sharded_loop(first_page, last_page, browsers)
+            return
+
         try:
-            number = int(input())
-            print()
+            number = int(answer)
             if number > 0:
                 self.multi_page_loop(number)
             else:
@@ -53,9 +121,56 @@ class RecordPoolDownloader:
         except ValueError:
             self.single_page_loop()
 
+    def incremental_loop(self):
+        """Download pages until reaching the newest track from the previous run."""
+        self.pool.enable_incremental()
+        if not self.pool.watermark:
+            if self.batch:
+                pages = max(1, self.settings.get("pages", 1))
+                print_yellow(f"No previous run found, downloading {pages} pages")
+            else:
+                print_yellow("No previous run found, give number of pages to download:")
+                try:
+                    pages = max(1, int(input()))
+                except ValueError:
+                    pages = 1
+
+            self.multi_page_loop(pages)
+            self.pool.save_watermark()
+            return
+
+        self.pool.update_current_page()
+        self.pool.journal.start_run("new", self.pool.current_page_number)
+        for page in range(1, self.max_incremental_pages + 1):
+            print_bold(f"--- Page: {self.pool.current_page_number} ---")
+            self.single_page_download(self.tracks_per_page)
+            if self.pool.reached_watermark:
+                print_bold("Reached tracks from previous run")
+                break
+
+            if page == self.max_incremental_pages:
+                # the previous newest track may have been removed, or the genre filter has changed
+                msg = f"Stopped after {page} pages without reaching the tracks from the previous run"
+                logging.warning(msg)
+                print_yellow(msg)
+                break
+
+            if not self.next_page():
+                print_red("No more pages!")
+                break
+
+        self.pool.journal.end_run()
+
+        # only move the watermark after the new tracks have been downloaded,
+        # and not past the tracks between the last page and the previous watermark
+        if self.pool.reached_watermark or page < self.max_incremental_pages:
+            self.pool.save_watermark()
+        self.play_notification_sound()
+
     def single_page_loop(self):
         """Download one page and ask to continue a single page at a time."""
         self.pool.update_current_page()
+        self.pool.journal.start_run("single", self.pool.current_page_number)
         while True:
             print_bold(f"--- Page: {self.pool.current_page_number} ---")
             try:
@@ -65,7 +180,7 @@ class RecordPoolDownloader:
                 number = 0
 
             self.single_page_download(number)
-            if not self.pool.next_page():
+            if not self.next_page():
                 print_red("No more pages!")
                 break
 
@@ -73,16 +188,29 @@ class RecordPoolDownloader:
             if input("Continue?\n").lower() not in ("y", "1"):
                 break
 
+        self.pool.journal.end_run()
+
     def multi_page_loop(self, pages=1):
         """Download multiple pages automatically."""
         self.pool.update_current_page()
         last_page = self.pool.current_page_number + pages - 1
-        for _ in range(1, pages + 1):
-            print_bold(f"--- Page: {self.pool.current_page_number} / {last_page} ---")
-            self.single_page_download()
-            if not self.pool.next_page():
-                print_red("No more pages!")
-                return
+        self.pool.journal.start_run("pages", self.pool.current_page_number, last_page)
+        more_pages = True
+        if self.pool.direct_download:
+            more_pages = self.pipelined_page_loop(pages, last_page)
+        else:
+            for _ in range(1, pages + 1):
+                print_bold(f"--- Page: {self.pool.current_page_number} / {last_page} ---")
+                self.single_page_download(self.tracks_per_page)
+                if not self.next_page():
+                    print_red("No more pages!")
+                    more_pages = False
+                    break
+
+        # a run that stops before this point can be continued with '--resume'
+        self.pool.journal.end_run()
+        if not more_pages or self.batch:
+            return
 
         self.play_notification_sound()
         print_bold("Continue for pages?")
@@ -93,6 +221,87 @@ class RecordPoolDownloader:
         except ValueError:
             return
 
+    def pipelined_page_loop(self, pages: int, last_page: int) -> bool:
+        """
+        Harvest the next pages in the browser while the files from previous pages are still downloading.
+
+        The bounded queue between the stages stops the browser from running too far ahead of the downloads.
+        Returns false if there are no more pages.
+        """
+        batches: queue.Queue[tuple[int, list[Track]] | None] = queue.Queue(maxsize=self.pipeline_depth)
+        consumer = threading.Thread(target=self._download_batches, args=(batches,), name="fetch")
+        consumer.start()
+        more_pages = True
+        try:
+            for _ in range(1, pages + 1):
+                print_bold(f"--- Page: {self.pool.current_page_number} / {last_page} ---")
+                batches.put((self.pool.current_page_number, self.pool.harvest_page(self.tracks_per_page)))
+                if not self.next_page():
+                    print_red("No more pages!")
+                    more_pages = False
+                    break
+        finally:
+            batches.put(None)
+            consumer.join()
+
+        return more_pages
+
+    def _download_batches(self, batches: queue.Queue):
+        """Download harvested pages from the queue until receiving None."""
+        while (batch := batches.get()) is not None:
+            page, tracks = batch
+            try:
+                num_tracks = self.pool.fetch(tracks)
+                logging.info(f"Page {page}: downloaded {num_tracks} files.")
+            except Exception:
+                # keep consuming so the harvesting thread never blocks on a full queue
+                logging.exception(f"Page {page}: download failed")
+
+    def sharded_loop(self, first_page: int, last_page: int, browsers: int):
+        """Download a range of pages with several browsers in parallel."""
+        if not self.pool.direct_download:
+            print_red(f"{self.pool} does not support parallel browsers")
+            return
+
+        self.pool.journal.start_run("sharded", first_page, last_page)
+        num_tracks = ShardedCrawler(self.pool, browsers, self.tracks_per_page).run(first_page, last_page)
+        self.pool.journal.end_run()
+        logging.info(f"Pages {first_page}-{last_page}: downloaded {num_tracks} files.")
+        self.play_notification_sound()
+
+    def resume(self) -> bool:
+        """Continue the previous multi-page run from where it stopped. Returns false if there is nothing to resume."""
+        point = self.pool.journal.resume_point()
+        if not point:
+            print_yellow("No interrupted run to resume")
+            return False
+
+        try:
+            self.pool.open_page(self.pool.page_url(point.page))
+        except NotImplementedError:
+            if not point.url:
+                print_yellow(f"{self.pool} can not open page {point.page} directly")
+                return False
+
+            self.pool.open_page(point.url)
+            if point.advance and not self.next_page():
+                print_red("No more pages!")
+                return True
+
+        print_bold(f"Resuming from page {point.page} / {point.last_page}")
+        logging.info(f"Resuming from page {point.page} / {point.last_page}")
+        self.multi_page_loop(point.last_page - point.page + 1)
+        return True
+
+    def next_page(self) -> bool:
+        """Load next page, or return false if there are no more pages available."""
+        with self.pool.stats.timer("page_load"):
+            if not self.pool.next_page():
+                return False
+
+            self.pool.wait_until_ready()
+            return True
+
     def single_page_download(self, num_to_download=0):
         """Download tracks from a single page."""
         tracks = self.pool.download_page(num_to_download)
@@ -100,25 +309,43 @@ class RecordPoolDownloader:
 
     def play_notification_sound(self):
         """Play system notification sound without waiting for function call to finish."""
-        threading.Thread(target=self._play_notification, args=(self.pool.platform.is_mac(),)).start()
+        threading.Thread(target=self._play_notification, args=(self.pool.platform,)).start()
 
     @staticmethod
-    def _play_notification(mac: bool):
-        if mac:
+    def _play_notification(platform: Platform):
+        if platform.is_mac():
             os.system("afplay /System/Library/Sounds/Glass.aiff")
-        else:
+        elif platform.is_windows():
             import winsound
 
             winsound.PlaySound("SystemExclamation", winsound.SND_ALIAS)
+        elif shutil.which("paplay") and os.path.exists(LINUX_NOTIFICATION_SOUND):
+            # a headless server usually has no sound output, in which case this fails silently
+            subprocess.run(["paplay", LINUX_NOTIFICATION_SOUND], capture_output=True)
 
     def download_bandcamp_order(self):
         """Download Bandcamp order."""
+        # Returns only after all files have been written to disk
+        self.pool.journal.start_run("bandcamp")
         self.pool.download_page()
-        self.pool.open_page("chrome://downloads/")
-        input("Wait until downloads have finished and press a button...\n")
+        self.pool.journal.end_run()
         self.pool.open_downloads_directory()
 
 
+def create_pool(site: Site, url="") -> RecordPool:
+    """Create the pool implementation for the given site."""
+    if site == Site.BEATJUNKIES:
+        return Beatjunkies()
+    if site == Site.BPMSUPREME:
+        return BPMSupreme()
+    if site == Site.DJCITY:
+        return DJCity()
+    if site == Site.BANDCAMP:
+        return Bandcamp(url)
+
+    raise RuntimeError(f"Unsupported record pool: {site}")
+
+
 def get_pool_to_use(site_name: str) -> Site:
     """Ask user for Recordpool to use."""
     while not site_name:
@@ -144,31 +371,213 @@ def get_pool_to_use(site_name: str) -> Site:
         print_error_and_exit(f"Unsupported record pool: {site_name}")
 
 
+def comma_list(value: str) -> list[str]:
+    """Split comma separated command line argument to a list."""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Web automation tool for automatic DJ recordpool song downloads.",
+        epilog="Options can also be set in a TOML config file, see README for the format.",
+    )
+    parser.add_argument(
+        "pools",
+        nargs="*",
+        help="pools to download from one after another (Beatjunkies, BPMSupreme, DJCity), or a Bandcamp order url",
+    )
+    parser.add_argument("-c", "--config", default="", help=f"config file, default is '{default_config_path()}'")
+    parser.add_argument("-p", "--pages", type=int, help="number of pages to download")
+    parser.add_argument("-s", "--start-page", type=int, help="page number to start from")
+    parser.add_argument("-t", "--tracks", type=int, help="number of tracks to download per page, 0 = all")
+    parser.add_argument(
+        "-n",
+        "--new",
+        action="store_true",
+        help="download new tracks since the previous run, checking at most --pages pages (default 20)",
+    )
+    parser.add_argument("-b", "--browsers", type=int, help="number of parallel browsers for the page range")
+    parser.add_argument("-w", "--workers", type=int, help="number of parallel file downloads")
+    parser.add_argument("-g", "--genres", type=comma_list, help="comma separated genres to download (DJCity)")
+    parser.add_argument("--ignore-genres", type=comma_list, help="comma separated genres to skip (BPMSupreme)")
+    parser.add_argument("--ignore-versions", type=comma_list, help="comma separated versions to skip (BPMSupreme)")
+    parser.add_argument("--headless", action="store_true", help="run browser without a window")
+    parser.add_argument("-d", "--download-root", help="directory for downloads, each pool uses a subdirectory")
+    parser.add_argument("--chrome-profile", help="Chrome user data directory to use")
+    parser.add_argument(
+        "--attach",
+        dest="debugger_address",
+        metavar="ADDRESS",
+        help="use a running Chrome started with --remote-debugging-port, for example 127.0.0.1:9222",
+    )
+    parser.add_argument("--plan", metavar="MANIFEST", help="write the tracks to a manifest file instead of downloading")
+    parser.add_argument("--priority", type=int, help="priority of the planned tracks, higher is fetched first")
+    parser.add_argument(
+        "--fetch",
+        nargs="+",
+        metavar="MANIFEST",
+        help="download the tracks in the given manifest files without a browser, only for the given pools if any",
+    )
+    parser.add_argument(
+        "--parallel", action="store_true", help="download from all given pools at the same time, implies --batch"
+    )
+    parser.add_argument("-y", "--batch", action="store_true", help="never ask for input, for unattended runs")
+    parser.add_argument("--resume", action="store_true", help="continue the previous run from where it stopped")
+    return parser.parse_args()
+
+
+def get_settings(args: argparse.Namespace, config: dict, site: Site) -> dict:
+    """Combine config file settings for the pool with the command line arguments, which take precedence."""
+    settings = pool_settings(config, site)
+    for key, value in vars(args).items():
+        if key in ("pools", "config", "fetch", "parallel") or value is None or value is False:
+            continue
+
+        settings[key] = value
+
+    return settings
+
+
+def run_pool(site_name: str, args: argparse.Namespace, config: dict):
+    """Download from one pool."""
+    recordpool_site = Site.BANDCAMP if "https://bandcamp.com/download" in site_name else get_pool_to_use(site_name)
+    settings = get_settings(args, config, recordpool_site)
+    try:
+        if recordpool_site == Site.BANDCAMP:
+            url = site_name if site_name.startswith("https://") else input("\nGive Bandcamp order URL:\n")
+            downloader = RecordPoolDownloader(recordpool_site, url=url, settings=settings)
+            downloader.download_bandcamp_order()
+        else:
+            downloader = RecordPoolDownloader(recordpool_site, settings=settings)
+            downloader.run()
+
+        downloader.pool.quit()
+    except Exception:
+        logging.exception("Exception raised!")
+        error_type, error_value, trace = sys.exc_info()
+        print_error(error_type)
+        if error_value:
+            print_red(error_value)
+        for line in traceback.format_tb(trace):
+            print_yellow(line)
+
+
+def fetch_manifests(paths: list[str], args: argparse.Namespace, config: dict):
+    """
+    Download the planned tracks from manifest files without opening a browser.
+
+    Uses the saved login session of each pool for authentication.
+    The pools download at the same time, and each one starts its highest priority tracks first.
+    """
+    entries = read_manifests(paths, args.pools)
+    if not entries:
+        print_yellow("No planned tracks in the manifests")
+        return
+
+    planned: dict[str, list[ManifestEntry]] = {}
+    for entry in entries:
+        planned.setdefault(entry.pool, []).append(entry)
+
+    pools: dict[str, RecordPool] = {}
+    downloads: dict[str, dict[Future, Track]] = {}
+    for name, pool_entries in planned.items():
+        site = get_pool_to_use(name)
+        pool = create_pool(site)
+        pool.configure(get_settings(args, config, site))
+        tracks = pool.ledger.filter_new(pool.name, [entry.track() for entry in pool_entries])
+        expected_mb = sum(entry.size or 0 for entry in pool_entries) / (1024 * 1024)
+        cookies = pool.session.cookies()
+        if not tracks:
+            print_yellow(f"{pool}: all planned tracks have already been downloaded")
+        elif not cookies:
+            # without the cookies every request would get the login page instead of the file
+            print_error(
+                f"{pool}: no saved login session, or it has expired. "
+                f"Log in with a normal run first, for example: python src/RecordPoolDownloader.py {name.lower()} --pages 1"
+            )
+        elif not pool.check_free_disk_space(1024 + expected_mb):
+            print_error(f"{pool}: not enough free disk space for {expected_mb:.0f} MB of planned downloads")
+        else:
+            pool.start_staging()
+            pool.http = pool.create_http_downloader()
+            pool.http.load_cookies(cookies)
+            pool.ledger.mark_queued(pool.name, tracks)
+            pool.journal.start_run("fetch")
+            pool.journal.queued(tracks)
+            print_magenta(f"{pool}: downloading {len(tracks)} planned tracks...")
+            with pool.stats.timer("dispatch"):
+                downloads[name] = {pool.http.submit(track): track for track in tracks}
+
+        pools[name] = pool
+
+    for name, pool in pools.items():
+        if name in downloads:
+            with pool.stats.timer("completion_wait"):
+                results = pool.http.wait(downloads[name])
+
+            pool.total_files_downloaded += pool.record_downloads(list(downloads[name].values()), results)
+            pool.journal.end_run()
+            pool.print_stats()
+            try:
+                pool.stats.export(pool.metrics_dir)
+            except OSError as e:
+                logging.error(f"Could not export run stats: {e}")
+
+        pool.quit()
+
+
+def run_parallel(pool_names: list[str], args: argparse.Namespace, config: dict):
+    """Download from several pools at the same time, sharing the transfer limit given with '--workers'."""
+    sites = []
+    for name in pool_names:
+        if "https://bandcamp.com/download" in name:
+            print_yellow("Bandcamp orders can not be downloaded in parallel, skipping")
+        elif name:
+            sites.append(get_pool_to_use(name))
+
+    if not sites:
+        print_error_and_exit("No record pools given for the parallel run")
+
+    scheduler = PoolScheduler(args.workers or config.get("workers", 4))
+    for site in sites:
+        settings = get_settings(args, config, site)
+        # prompts from several pools at once would be mixed up
+        settings["batch"] = True
+        scheduler.add(str(site), lambda site=site, settings=settings: run_scheduled(site, settings, scheduler))
+
+    scheduler.wait()
+
+
+def run_scheduled(site: Site, settings: dict, scheduler: PoolScheduler) -> RunStats:
+    """Run one pool of a parallel run and return its stats."""
+    downloader = RecordPoolDownloader(site, settings=settings, scheduler=scheduler)
+    try:
+        downloader.run()
+    finally:
+        downloader.pool.quit()
+
+    return downloader.pool.stats
+
+
 if __name__ == "__main__":
     print_cyan("RECORDPOOL DL", bold=True)
-    args = sys.argv[1:]
-    recordpool_site: Site | None = None
     try:
-        # Try reading recordpool to use from first argument
-        # TODO: use click or typer here for proper CLI handling
-        site_name: str = args[0].strip() if args else ""
-        recordpool_site = Site.BANDCAMP if "https://bandcamp.com/download" in site_name else get_pool_to_use(site_name)
-        try:
-            if recordpool_site == Site.BANDCAMP:
-                url = site_name if site_name.startswith("https://") else input("\nGive Bandcamp order URL:\n")
-                downloader = RecordPoolDownloader(recordpool_site, url=url)
-                downloader.download_bandcamp_order()
-            else:
-                downloader = RecordPoolDownloader(recordpool_site)
-                downloader.run_loop()
-        except Exception:
-            logging.exception("Exception raised!")
-            error_type, error_value, trace = sys.exc_info()
-            print_error(error_type)
-            if error_value:
-                print_red(error_value)
-            for line in traceback.format_tb(trace):
-                print_yellow(line)
+        args = parse_args()
+        config = load_config(args.config)
+        pools = args.pools if args.pools else config.get("pools", [])
+        if not pools and not args.fetch:
+            if args.batch or config.get("batch"):
+                print_error_and_exit("No record pool given")
+
+            pools = [""]
+
+        if args.fetch:
+            fetch_manifests(args.fetch, args, config)
+        elif args.parallel or config.get("parallel"):
+            run_parallel([name.strip() for name in pools], args, config)
+        else:
+            for name in pools:
+                run_pool(name.strip(), args, config)
 
     except KeyboardInterrupt:
         print_bold("\nAborted")
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+
+from dataclasses import dataclass
+from datetime import datetime
+
+from utils import Track, get_state_dir
+
+
+@dataclass
+class ResumePoint:
+    """Where an interrupted run should continue from."""
+
+    page: int
+    url: str
+    last_page: int
+    # True if 'url' is the last finished page, and the run should continue from the page after it
+    advance: bool = False
+
+
+class RunJournal:
+    """
+    Append-only JSON Lines journal of crawl progress for one pool.
+
+    Records the start of each run, every harvested page with its tracks,
+    and every finished or failed track, so an interrupted run can be resumed from the right page.
+    Each event is written and flushed immediately, so the journal survives crashes.
+    """
+
+    def __init__(self, pool: str, path: str = ""):
+        self.path: str = path if path else os.path.join(get_state_dir(), f"{pool}.journal.jsonl")
+        self._lock = threading.Lock()
+
+    def record(self, event: str, **fields):
+        """Append one event to the journal."""
+        line = json.dumps({"time": datetime.now().isoformat(timespec="seconds"), "event": event, **fields})
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+    def start_run(self, mode: str, first_page: int = 0, last_page: int = 0):
+        """Mark the start of a run. Every mode records its runs, so events are never attributed to an earlier run."""
+        self.record("run_start", mode=mode, first_page=first_page, last_page=last_page)
+
+    def end_run(self):
+        self.record("run_end")
+
+    def page(self, number: int, url: str, tracks: list[Track]):
+        self.record("page", page=number, url=url, tracks=[track.id for track in tracks])
+
+    def queued(self, tracks: list[Track]):
+        for track in tracks:
+            self.record("queued", track=track.id)
+
+    def done(self, track: Track, path: str = ""):
+        self.record("done", track=track.id, path=path)
+
+    def failed(self, track: Track):
+        self.record("failed", track=track.id)
+
+    def resume_point(self) -> ResumePoint | None:
+        """Return where the last run died, or None if it finished or there is no previous run."""
+        events = self._last_run()
+        # only multi-page runs have a known end page to continue to
+        if not events or events[-1]["event"] == "run_end" or events[0]["mode"] != "pages":
+            return None
+
+        start = events[0]
+        done = {event["track"] for event in events if event["event"] == "done"}
+        pages = [event for event in events if event["event"] == "page"]
+        # Pages can be harvested ahead of the downloads, so continue from the first page with unfinished tracks
+        for page in pages:
+            if any(track not in done for track in page["tracks"]):
+                return ResumePoint(page["page"], page["url"], start["last_page"])
+
+        if pages:
+            # every harvested page was finished, continue from the next page
+            last = pages[-1]
+            if last["page"] >= start["last_page"]:
+                return None
+
+            return ResumePoint(last["page"] + 1, last["url"], start["last_page"], advance=True)
+
+        return ResumePoint(start["first_page"], "", start["last_page"])
+
+    def _last_run(self) -> list[dict]:
+        """Return the events of the most recent run."""
+        if not os.path.exists(self.path):
+            return []
+
+        events = []
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line can be cut short if the process was killed while writing
+                    logging.warning(f"Skipping invalid journal line: {line.strip()}")
+                    continue
+
+                if event["event"] == "run_start":
+                    events = []
+
+                events.append(event)
+
+        return events if events and events[0]["event"] == "run_start" else []
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+
+from utils import get_state_dir
+
+
+class RunStats:
+    """
+    Timing and throughput statistics for one run.
+
+    Collects the time spent in each phase (driver start, page load, link harvest, dispatch, transfer,
+    completion wait) and the size and transfer time of every downloaded file.
+    Exported as one JSON line per run and as a Prometheus textfile for the node exporter textfile collector.
+    """
+
+    def __init__(self, pool: str):
+        self.pool: str = pool
+        self.started: float = time.time()
+        # phase name -> list of durations in seconds
+        self.phases: dict[str, list[float]] = defaultdict(list)
+        # name, size in bytes and transfer time in seconds if known
+        self.files: list[dict] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, phase: str) -> Iterator[None]:
+        """Measure the duration of the code block as one occurrence of the given phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase].append(seconds)
+
+    def add_file(self, name: str, size: int, seconds: float | None = None):
+        with self._lock:
+            self.files.append({"name": name, "bytes": size, "seconds": seconds})
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(file["bytes"] for file in self.files)
+
+    @property
+    def duration(self) -> float:
+        return time.time() - self.started
+
+    def megabytes_per_second(self) -> float:
+        """Average download speed over the whole run."""
+        return self.total_bytes / (1024 * 1024) / self.duration if self.duration else 0.0
+
+    def summary(self) -> dict:
+        """Return the run statistics as a dictionary."""
+        with self._lock:
+            phases = {
+                name: {
+                    "count": len(times),
+                    "total": round(sum(times), 3),
+                    "mean": round(sum(times) / len(times), 3),
+                    "max": round(max(times), 3),
+                }
+                for name, times in self.phases.items()
+            }
+            files = list(self.files)
+
+        return {
+            "pool": self.pool,
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "duration": round(self.duration, 3),
+            "files": len(files),
+            "bytes": sum(file["bytes"] for file in files),
+            "mb_per_s": round(self.megabytes_per_second(), 3),
+            "phases": phases,
+            "file_stats": files,
+        }
+
+    def export(self, directory: str = ""):
+        """Append the run summary to 'stats.jsonl' and write the Prometheus metrics file in the given directory."""
+        directory = directory if directory else get_state_dir()
+        os.makedirs(directory, exist_ok=True)
+        summary = self.summary()
+        with open(os.path.join(directory, "stats.jsonl"), "a", encoding="utf-8") as file:
+            file.write(json.dumps(summary) + "\n")
+
+        # write to a temp file and rename, so the textfile collector never reads a partial file
+        path = os.path.join(directory, f"recordpool_{self.pool.lower()}.prom")
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            file.write(self._prometheus(summary))
+
+        os.replace(path + ".tmp", path)
+        logging.info(f"Exported run stats to {directory}")
+
+    @staticmethod
+    def _prometheus(summary: dict) -> str:
+        """Format run summary in the Prometheus text exposition format."""
+        pool = f'pool="{summary["pool"]}"'
+        metrics = [
+            ("recordpool_files", "Files downloaded in the last run.", {pool: summary["files"]}),
+            ("recordpool_bytes", "Bytes downloaded in the last run.", {pool: summary["bytes"]}),
+            ("recordpool_run_duration_seconds", "Duration of the last run.", {pool: summary["duration"]}),
+            (
+                "recordpool_throughput_bytes_per_second",
+                "Average download speed of the last run.",
+                {pool: round(summary["bytes"] / summary["duration"]) if summary["duration"] else 0},
+            ),
+            (
+                "recordpool_phase_seconds",
+                "Total time spent in each phase in the last run.",
+                {f'{pool},phase="{name}"': phase["total"] for name, phase in summary["phases"].items()},
+            ),
+            (
+                "recordpool_phase_count",
+                "Number of times each phase was run in the last run.",
+                {f'{pool},phase="{name}"': phase["count"] for name, phase in summary["phases"].items()},
+            ),
+            ("recordpool_last_run_timestamp_seconds", "End time of the last run.", {pool: round(time.time())}),
+        ]
+        lines = []
+        for name, description, values in metrics:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{{{labels}}} {value}" for labels, value in values.items())
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+from selenium import webdriver
+
+from utils import get_state_dir
+
+# Cookie fields accepted by the DevTools 'Network.setCookies' command
+COOKIE_FIELDS = ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite", "expires")
+
+# Restores saved local storage items before the page scripts run, without overwriting newer values
+LOCAL_STORAGE_SCRIPT = """
+if (location.origin === %s) {
+    const items = %s;
+    for (const [key, value] of Object.entries(items)) {
+        if (localStorage.getItem(key) === null) {
+            localStorage.setItem(key, value);
+        }
+    }
+}
+"""
+
+
+class SessionStore:
+    """
+    Saved login session for one pool.
+
+    Stores the cookies and local storage of a logged-in browser, so later runs can start from a fresh profile
+    instead of the real Chrome profile. The file is always encrypted with Fernet, using the key from
+    the RECORDPOOL_SESSION_KEY environment variable or the 'session.key' file in the state directory.
+    """
+
+    def __init__(self, pool: str, path: str = ""):
+        self.path: str = path if path else os.path.join(get_state_dir(), f"{pool}.session")
+
+    def available(self) -> bool:
+        """Return true if there is a saved session that has not expired."""
+        return bool(self.cookies())
+
+    def clear(self):
+        """Remove the saved session, for example after it has stopped working."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+            logging.info(f"Removed saved session: {self.path}")
+
+    def cookies(self) -> list[dict]:
+        """Return the saved cookies that have not expired, for downloading without a browser."""
+        data = self.load()
+        return self._valid_cookies(data) if data else []
+
+    def load(self) -> dict | None:
+        """Return the saved session, or None if there is no usable session file."""
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, "rb") as file:
+            content = file.read()
+
+        try:
+            content = Fernet(self._key()).decrypt(content)
+        except (InvalidToken, ValueError):
+            logging.warning(f"Could not decrypt session file, log in again to replace it: {self.path}")
+            return None
+
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            logging.warning(f"Invalid session file: {self.path}")
+            return None
+
+    def restore(self, driver: webdriver) -> bool:
+        """Load the saved session into the browser before the first page is opened. Returns false if there is none."""
+        data = self.load()
+        cookies = self._valid_cookies(data) if data else []
+        if not cookies:
+            return False
+
+        # DevTools commands work without opening the site first, unlike 'driver.add_cookie'
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+        if data["local_storage"]:
+            script = LOCAL_STORAGE_SCRIPT % (json.dumps(data["origin"]), json.dumps(data["local_storage"]))
+            driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": script})
+
+        logging.info(f"Restored session with {len(cookies)} cookies from {self.path}")
+        return True
+
+    def save(self, driver: webdriver):
+        """Save the cookies and local storage of the site that is currently open in the browser."""
+        # only cookies sent to the current site, not every cookie in the profile
+        cookies = driver.execute_cdp_cmd("Network.getCookies", {"urls": [driver.current_url]})["cookies"]
+        data = {
+            "saved_at": time.time(),
+            "origin": driver.execute_script("return location.origin"),
+            "cookies": [{key: cookie[key] for key in COOKIE_FIELDS if key in cookie} for cookie in cookies],
+            "local_storage": driver.execute_script("return Object.assign({}, window.localStorage)"),
+        }
+        content = Fernet(self._key()).encrypt(json.dumps(data).encode())
+        self._write(self.path, content)
+        logging.info(f"Saved session with {len(cookies)} cookies to {self.path}")
+
+    def _key(self) -> bytes:
+        """Return the encryption key, creating a key file on first use."""
+        if key := os.environ.get("RECORDPOOL_SESSION_KEY"):
+            return key.encode()
+
+        path = os.path.join(os.path.dirname(self.path), "session.key")
+        if not os.path.exists(path):
+            self._write(path, Fernet.generate_key())
+
+        with open(path, "rb") as file:
+            return file.read().strip()
+
+    @staticmethod
+    def _valid_cookies(data: dict) -> list[dict]:
+        """Return the cookies that have not expired. Session cookies have no expiry time."""
+        now = time.time()
+        return [
+            cookie for cookie in data.get("cookies", []) if cookie.get("expires", -1) <= 0 or cookie["expires"] > now
+        ]
+
+    @staticmethod
+    def _write(path: str, content: bytes):
+        """Write file readable only by the current user, replacing the old file at once."""
+        temp_path = path + ".tmp"
+        descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+
+        os.replace(temp_path, path)
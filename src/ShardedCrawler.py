@@ -0,0 +1,73 @@
+import logging
+import queue
+import threading
+
+from colorprint import print_bold, print_magenta
+from RecordPool import RecordPool
+
+
+class ShardedCrawler:
+    """
+    Crawl a range of pages with several headless browsers at the same time.
+
+    Each worker browser uses its own copy of the Chrome profile,
+    takes the next page number from a shared queue and opens it directly with 'page_url'.
+    All workers hand their tracks to the same HttpDownloader, so downloads share one connection pool.
+    The downloader uses the session of the main pool browser, copied once before the workers start,
+    so the workers never change the cookies or headers while files are transferring.
+    """
+
+    def __init__(self, pool: RecordPool, workers: int = 4, tracks_per_page: int = 0):
+        self.pool: RecordPool = pool
+        self.workers: int = workers
+        # Number of tracks to download from each page, all tracks if zero
+        self.tracks_per_page: int = tracks_per_page
+        self.pages: queue.Queue[int] = queue.Queue()
+        self.total_files_downloaded: int = 0
+        self._lock = threading.Lock()
+
+    def run(self, first_page: int, last_page: int) -> int:
+        """Download all pages in the given range and return the number of downloaded files."""
+        for page in range(first_page, last_page + 1):
+            self.pages.put(page)
+
+        self.pool.http.copy_browser_session(self.pool.driver)
+        num_workers = min(self.workers, last_page - first_page + 1)
+        print_magenta(f"Crawling pages {first_page}-{last_page} with {num_workers} browsers...")
+        threads = [
+            threading.Thread(target=self._work, name=f"{self.pool.name}-{number}") for number in range(num_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.pool.total_files_downloaded += self.total_files_downloaded
+        return self.total_files_downloaded
+
+    def _work(self):
+        """Process pages from the queue in one worker browser until all pages are done."""
+        worker = self.pool.create_worker(self.pool.http)
+        try:
+            worker.start_driver(prepare=False)
+            while True:
+                try:
+                    page = self.pages.get_nowait()
+                except queue.Empty:
+                    break
+
+                try:
+                    worker.open_page(worker.page_url(page))
+                    print_bold(f"--- Page: {page} ---")
+                    num_tracks = worker.fetch(worker.harvest_page(self.tracks_per_page))
+                    logging.info(f"Page {page}: downloaded {num_tracks} files.")
+                    with self._lock:
+                        self.total_files_downloaded += num_tracks
+                except Exception:
+                    logging.exception(f"Page {page} failed")
+        finally:
+            # the downloader and staging area are shared with the other workers, so they must not be closed here
+            worker.http = None
+            worker.staging = None
+            worker.quit()
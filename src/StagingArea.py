@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+
+from collections.abc import Callable
+
+# Files that are still being written, which are never moved to the library
+PARTIAL_SUFFIXES = (".part", ".part.json", ".crdownload", ".tmp")
+
+
+class StagingArea:
+    """
+    Local directory that downloads are written to before they are moved into the synced music library.
+
+    Finished files are moved to the library in batches at a fixed interval, and when the staging area is closed.
+    The staging directory must be on the same filesystem as the library, so each move is an atomic rename
+    and the sync client only ever sees complete files.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        library_path: str,
+        interval: float = 30.0,
+        on_commit: Callable[[str, str], None] | None = None,
+    ):
+        self.interval: float = interval
+        self.library_path: str = library_path
+        # Called with the staged path and the library path of every moved file
+        self.on_commit: Callable[[str, str], None] | None = on_commit
+        self.path: str = path
+        self._lock = threading.Lock()
+        self._pending: list[str] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        os.makedirs(self.path, exist_ok=True)
+        # finished files left over from a run that stopped before committing them
+        with os.scandir(self.path) as entries:
+            self._pending.extend(
+                entry.path
+                for entry in entries
+                if entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(PARTIAL_SUFFIXES)
+            )
+
+    @staticmethod
+    def same_filesystem(path: str, library_path: str) -> bool:
+        """Return true if files can be renamed from the path to the library without copying."""
+        os.makedirs(path, exist_ok=True)
+        return os.stat(path).st_dev == os.stat(library_path).st_dev
+
+    def start(self):
+        """Start committing files in the background."""
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="staging", daemon=True)
+            self._thread.start()
+
+    def add(self, path: str):
+        """Queue a complete, verified file for moving to the library."""
+        if path and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.path):
+            with self._lock:
+                self._pending.append(path)
+
+    def commit(self) -> int:
+        """Move all queued files to the library and return the number of moved files."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            moved = 0
+            for path in pending:
+                if not os.path.exists(path):
+                    continue
+
+                target = self._free_path(os.path.basename(path))
+                try:
+                    os.replace(path, target)
+                except OSError as e:
+                    logging.error(f"Could not move '{path}' to the library: {e}")
+                    continue
+
+                moved += 1
+                if self.on_commit:
+                    self.on_commit(path, target)
+
+        if moved:
+            logging.info(f"Moved {moved} files to {self.library_path}")
+
+        return moved
+
+    def close(self):
+        """Stop the background commits and move the remaining files."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        self.commit()
+
+    def _free_path(self, filename: str) -> str:
+        """Return a library path for the filename that does not overwrite an existing file."""
+        stem, extension = os.path.splitext(filename)
+        path = os.path.join(self.library_path, filename)
+        number = 1
+        while os.path.exists(path):
+            path = os.path.join(self.library_path, f"{stem} ({number}){extension}")
+            number += 1
+
+        return path
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.commit()
@@ -0,0 +1,148 @@
+import fnmatch
+import logging
+import os
+import re
+
+from dataclasses import dataclass, field
+from urllib.parse import unquote, urlparse
+
+from utils import Track
+
+# Track fields that rules can match with name patterns
+TEXT_FIELDS = ("artist", "title", "version", "genre", "key")
+
+
+@dataclass
+class Rule:
+    """One compiled selection rule. A track matches when every given field matches."""
+
+    action: str
+    # field name -> compiled pattern matching any of the given values
+    patterns: dict[str, re.Pattern] = field(default_factory=dict)
+    bpm: tuple[float, float] | None = None
+
+    def matches(self, track: Track) -> bool:
+        for name, pattern in self.patterns.items():
+            if not pattern.match(getattr(track, name) or ""):
+                return False
+
+        if self.bpm:
+            return track.bpm is not None and self.bpm[0] <= track.bpm <= self.bpm[1]
+
+        return True
+
+
+class TrackRules:
+    """
+    Config-driven selection of the tracks to download.
+
+    Rules are checked in order and the first matching rule decides if a track is kept or skipped.
+    Tracks that match no rule are kept. Text fields are matched case-insensitively against glob patterns,
+    or regular expressions prefixed with "re:". BPM is matched against an inclusive [min, max] range.
+    Optionally only one version of each title is kept, picked by the order of 'prefer_versions'.
+
+    ```toml
+    prefer_versions = ["Dirty", "Clean"]
+
+    [[rules]]
+    action = "skip"
+    version = ["*Short Edit", "Quick Hit*"]
+
+    [[rules]]
+    action = "skip"
+    bpm = [0, 70]
+    ```
+    """
+
+    def __init__(self, rules: list[dict] | None = None, prefer_versions: list[str] | None = None):
+        self.rules: list[Rule] = [self.compile(rule) for rule in rules or []]
+        self.prefer_versions: list[re.Pattern] = [self._pattern([version]) for version in prefer_versions or []]
+
+    @staticmethod
+    def compile(rule: dict) -> Rule:
+        """Compile one rule from its config table."""
+        action = rule.get("action", "skip")
+        if action not in ("keep", "skip"):
+            raise ValueError(f"Invalid rule action: '{action}'")
+
+        unknown = set(rule) - {"action", "bpm", *TEXT_FIELDS}
+        if unknown:
+            raise ValueError(f"Unknown rule fields: {', '.join(sorted(unknown))}")
+
+        patterns = {}
+        for name in TEXT_FIELDS:
+            if name in rule:
+                values = rule[name] if isinstance(rule[name], list) else [rule[name]]
+                patterns[name] = TrackRules._pattern(values)
+
+        bpm = (float(rule["bpm"][0]), float(rule["bpm"][1])) if "bpm" in rule else None
+        return Rule(action, patterns, bpm)
+
+    def select(self, tracks: list[Track]) -> list[Track]:
+        """Return the tracks to download, in the original order."""
+        selected = [track for track in tracks if self.keep(track)]
+        if self.prefer_versions:
+            selected = self._deduplicate(selected)
+
+        if len(selected) < len(tracks):
+            logging.info(f"Track rules skipped {len(tracks) - len(selected)} of {len(tracks)} tracks")
+
+        return selected
+
+    def keep(self, track: Track) -> bool:
+        for rule in self.rules:
+            if rule.matches(track):
+                return rule.action == "keep"
+
+        return True
+
+    def _deduplicate(self, tracks: list[Track]) -> list[Track]:
+        """Keep only the most preferred version of each title."""
+        best: dict[tuple[str, str], Track] = {}
+        for track in tracks:
+            key = (track.artist.lower(), track.title.lower())
+            if key not in best or self._rank(track) < self._rank(best[key]):
+                best[key] = track
+
+        kept = {id(track) for track in best.values()}
+        return [track for track in tracks if id(track) in kept or not track.title]
+
+    def _rank(self, track: Track) -> int:
+        for index, pattern in enumerate(self.prefer_versions):
+            if pattern.match(track.version):
+                return index
+
+        return len(self.prefer_versions)
+
+    @staticmethod
+    def _pattern(values: list[str]) -> re.Pattern:
+        """Combine glob patterns and "re:" regular expressions to one case-insensitive pattern."""
+        parts = [
+            f"(?:{value[3:]})\\Z" if value.startswith("re:") else fnmatch.translate(str(value)) for value in values
+        ]
+        return re.compile("|".join(parts), re.IGNORECASE)
+
+
+def parse_title(text: str) -> tuple[str, str, str]:
+    """
+    Split a track name like "Artist - Title (Dirty Intro)" to artist, title and version.
+
+    The version is the last part in parentheses or brackets, and the artist is empty if there is no separator.
+    """
+    text = text.strip()
+    version = ""
+    if match := re.search(r"\s*[(\[]([^()\[\]]+)[)\]]\s*$", text):
+        version = match.group(1).strip()
+        text = text[: match.start()]
+
+    artist, separator, title = text.partition(" - ")
+    if not separator:
+        return "", text.strip(), version
+
+    return artist.strip(), title.strip(), version
+
+
+def parse_url(url: str) -> tuple[str, str, str]:
+    """Get artist, title and version from the file name in a download url."""
+    name = os.path.splitext(unquote(os.path.basename(urlparse(url).path)))[0]
+    return parse_title(name.replace("_", " "))
@@ -0,0 +1,57 @@
+"""
+Resource blocking rules
+URL patterns for page resources the downloader never uses, grouped by category.
+Blocked through the DevTools 'Network.setBlockedURLs' command, where '*' matches any characters.
+"""
+
+
+def extensions(*names: str) -> tuple[str, ...]:
+    """Return patterns matching urls for files with the given extensions, with or without a query string."""
+    return tuple(pattern for name in names for pattern in (f"*.{name}", f"*.{name}?*"))
+
+
+BLOCK_RULES: dict[str, tuple[str, ...]] = {
+    "images": extensions("jpg", "jpeg", "png", "gif", "webp", "avif", "svg", "ico"),
+    "fonts": (*extensions("woff", "woff2", "ttf", "otf", "eot"), "*fonts.googleapis.com*", "*fonts.gstatic.com*"),
+    # audio previews and streams
+    "media": extensions("mp3", "m4a", "aac", "ogg", "wav", "m3u8", "mpd"),
+    "trackers": (
+        "*google-analytics.com*",
+        "*googletagmanager.com*",
+        "*googleadservices.com*",
+        "*doubleclick.net*",
+        "*connect.facebook.net*",
+        "*facebook.com/tr*",
+        "*hotjar.com*",
+        "*clarity.ms*",
+        "*segment.com*",
+        "*segment.io*",
+        "*mixpanel.com*",
+        "*amplitude.com*",
+        "*fullstory.com*",
+        "*intercom.io*",
+        "*nr-data.net*",
+        "*quantserve.com*",
+        "*scorecardresearch.com*",
+    ),
+}
+
+
+def blocked_urls(categories: list[str] | tuple[str, ...], allow: list[str] | tuple[str, ...] = ()) -> list[str]:
+    """
+    Return the URL patterns to block for the given categories.
+
+    The allowlist can contain whole categories or single patterns, which are removed from the blocked patterns.
+    """
+    allowed = set(allow)
+    patterns = []
+    for category in categories:
+        if category in allowed:
+            continue
+
+        if category not in BLOCK_RULES:
+            raise ValueError(f"Unknown resource category: '{category}'")
+
+        patterns.extend(pattern for pattern in BLOCK_RULES[category] if pattern not in allowed)
+
+    return patterns
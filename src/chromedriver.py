@@ -0,0 +1,117 @@
+"""
+ChromeDriver binary cache
+Keeps one driver per installed Chrome version in the state directory,
+so starting the browser does not need a network version check, and works offline.
+"""
+
+import glob
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from webdriver_manager.chrome import ChromeDriverManager
+
+from colorprint import print_yellow
+from utils import Platform, get_state_dir
+
+
+def cache_dir() -> str:
+    """Return the directory for cached ChromeDriver binaries."""
+    path = os.path.join(get_state_dir(), "chromedriver")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def chrome_version() -> str:
+    """Return the installed Chrome version without starting the browser, or an empty string if not found."""
+    platform = Platform.get()
+    if platform.is_windows():
+        import winreg
+
+        try:
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Google\Chrome\BLBeacon") as key:
+                return winreg.QueryValueEx(key, "version")[0]
+        except OSError:
+            return ""
+
+    if platform.is_mac():
+        commands = [["/Applications/Google Chrome.app/Contents/MacOS/Google Chrome", "--version"]]
+    else:
+        commands = [
+            [name, "--version"] for name in ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser")
+        ]
+
+    for command in commands:
+        try:
+            output = subprocess.run(command, capture_output=True, text=True, timeout=10).stdout
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+
+        if match := re.search(r"\d+\.\d+\.\d+\.\d+", output):
+            return match.group(0)
+
+    return ""
+
+
+def chromedriver_path() -> str:
+    """
+    Return the path to a ChromeDriver matching the installed Chrome.
+
+    Drivers are cached by Chrome build number, since the driver for a build works with all its patch versions.
+    A new driver is only downloaded when Chrome has been updated.
+    Without network access, the newest cached driver for the same major version is used instead,
+    since a driver for another major version can not start Chrome.
+    """
+    version = chrome_version()
+    build = version.rsplit(".", 1)[0] if version else ""
+    name = "chromedriver.exe" if Platform.get().is_windows() else "chromedriver"
+    path = os.path.join(cache_dir(), build, name) if build else ""
+    if path and os.path.exists(path):
+        logging.debug(f"Using cached ChromeDriver {build}: {path}")
+        return path
+
+    try:
+        installed = ChromeDriverManager().install()
+    except Exception as e:
+        fallback = newest_cached_driver(version.split(".")[0] if version else "")
+        if not fallback:
+            raise
+
+        logging.warning(f"Could not get ChromeDriver, using cached driver {fallback}: {e}")
+        print_yellow(f"Could not get ChromeDriver, using cached driver: {fallback}")
+        return fallback
+
+    if not path:
+        return installed
+
+    # copy to a unique temp file first, so parallel browsers never see or overwrite a partially copied driver
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(prefix=f".{name}-", suffix=".tmp", dir=os.path.dirname(path))
+    os.close(descriptor)
+    try:
+        shutil.copy2(installed, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    logging.info(f"Cached ChromeDriver for Chrome {version}: {path}")
+    return path
+
+
+def newest_cached_driver(major: str) -> str:
+    """Return the newest cached driver for the given Chrome major version, or an empty string if there is none."""
+    if not major:
+        return ""
+
+    drivers = glob.glob(os.path.join(cache_dir(), "*", "chromedriver*"))
+    drivers = [driver for driver in drivers if not driver.endswith(".tmp")]
+
+    def build_number(driver: str) -> tuple[int, ...]:
+        return tuple(int(part) for part in os.path.basename(os.path.dirname(driver)).split(".") if part.isdigit())
+
+    matching = [driver for driver in drivers if build_number(driver)[:1] == (int(major),)]
+    return max(matching, key=build_number) if matching else ""
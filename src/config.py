@@ -0,0 +1,35 @@
+"""
+Config file handling
+Settings can be given in a TOML file, either at the top level or in a table for a specific pool.
+"""
+
+import os
+import tomllib
+
+from utils import Site, get_state_dir
+
+
+def default_config_path() -> str:
+    """Return the default config file path."""
+    return os.path.join(get_state_dir(), "config.toml")
+
+
+def load_config(path: str = "") -> dict:
+    """Read settings from given TOML file, or from the default config file if it exists."""
+    if not path:
+        path = default_config_path()
+        if not os.path.exists(path):
+            return {}
+
+    with open(path, "rb") as file:
+        return tomllib.load(file)
+
+
+def pool_settings(config: dict, site: Site) -> dict:
+    """Return the settings for one pool: top level settings overridden by the pool specific table."""
+    settings = {key: value for key, value in config.items() if not isinstance(value, dict)}
+    for key, value in config.items():
+        if isinstance(value, dict) and key.lower() == site.name.lower():
+            settings.update(value)
+
+    return settings
@@ -1,7 +1,9 @@
+import os
 import platform
 
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Self
+from typing import Any, Self
 
 
 class Site(Enum):
@@ -18,6 +20,23 @@ class Site(Enum):
         return self.value
 
 
+@dataclass
+class Track:
+    """One downloadable file found on a pool page."""
+
+    # Stable identifier used to remember downloaded tracks between runs
+    id: str
+    url: str = ""
+    title: str = ""
+    version: str = ""
+    genre: str = ""
+    artist: str = ""
+    bpm: float | None = None
+    key: str = ""
+    # Browser element to click for pools that do not provide direct download links
+    element: Any = field(default=None, compare=False, repr=False)
+
+
 class Platform(Enum):
     """OS platform enum."""
 
@@ -68,5 +87,25 @@ class Platform(Enum):
             # For example: 'Windows 11 Professional 22621'
             return f"{self.value} {release} {platform.win32_edition()} {build_version}"
 
+        if self.is_linux():
+            try:
+                name = platform.freedesktop_os_release().get("PRETTY_NAME", platform.release())
+            except OSError:
+                name = platform.release()
+
+            # For example: 'Linux Ubuntu 22.04.3 LTS x86_64'
+            return f"{self.value} {name} {platform.machine()}"
+
         # For example: 'macOS 12.6 x86_64'
         return f"{self.value} {platform.mac_ver()[0]} {platform.machine()}"
+
+
+def get_state_dir() -> str:
+    """
+    Return the directory used for persistent data like the download ledger, creating it if needed.
+
+    Defaults to '~/.recordpool-dl', and can be changed with the RECORDPOOL_STATE_DIR environment variable.
+    """
+    path = os.environ.get("RECORDPOOL_STATE_DIR") or os.path.join(os.path.expanduser("~"), ".recordpool-dl")
+    os.makedirs(path, exist_ok=True)
+    return path